@@ -1,222 +1,260 @@
 import numpy as np
-import telnetlib
 from PyQt5.QtCore import QTimer, pyqtSignal, QObject
-import os
+import functools
+import threading
 import logging
+from acquisition import AcquisitionWorker, MultiAcquisitionWorker
+from braggmeter import BraggMeter
+from peaks import detect_peaks, peak_discrepancy
 
 logger = logging.getLogger(__name__)
 
-class BraggMeter:
-    def __init__(self, host='10.0.0.150', port=3500):
-        self.commands = {'status': ":STAT?\r\n".encode('ascii'),
-                         'start': ":ACQU:STAR\r\n".encode('ascii'),
-                         'stop': ":ACQU:STOP\r\n".encode('ascii'),
-                         'trace0': ":ACQU:OSAT:CHAN:0?\r\n".encode('ascii'),
-                         'trace1': ":ACQU:OSAT:CHAN:1?\r\n".encode('ascii'),
-                         'trace2': ":ACQU:OSAT:CHAN:2?\r\n".encode('ascii'),
-                         'trace3': ":ACQU:OSAT:CHAN:3?\r\n".encode('ascii'),
-                         'bragg0': ":ACQU:WAVE:CHAN:0?\r\n".encode('ascii'),
-                         'bragg1': ":ACQU:WAVE:CHAN:1?\r\n".encode('ascii'),
-                         'bragg2': ":ACQU:WAVE:CHAN:2?\r\n".encode('ascii'),
-                         'bragg3': ":ACQU:WAVE:CHAN:3?\r\n".encode('ascii'),
-                         }
-        self.host = host
-        self.port = port
-        self.timeout = 10
-        self.tn = telnetlib.Telnet(self.host, self.port, self.timeout)
-        self.tn.close()
-
-        status = self.get_status()
-        logger.info(f"BraggMeter status: {status}")
-        if status == 5:
-            err_msg = 'BraggMETER em aquecimento'
-            logger.error(err_msg)
-            raise RuntimeError(err_msg)
-
-    def ask(self, key):
-        string = self.commands[key]
-        resp = self.send(string)
-        return resp
-
-    def send(self, string):
-        self.tn.open(self.host, port=self.port)
-        self.tn.write(string)
-        resp = self.tn.read_until("\n".encode('ascii'), self.timeout)
-        resp = resp.decode()
-        logger.debug(f'{string} response: {resp}')
-        self.tn.close()
-        return resp
-
-    def start(self):
-        status = self.get_status()
-        logger.info(f'BraggMETER status: {status}')
-        if status == 1:
-            self.ask('start')
-        elif status == 3 or status == 4:
-            self.ask('stop')
-            self.ask('start')
-        elif status == 5:
-            err_msg = 'BraggMETER em aquecimento'
-            logger.error(err_msg)
-            raise RuntimeError(err_msg)
-
-    def stop(self):
-        resp = self.ask('stop')
-        status = self.get_status()
-        logger.info(f'BraggMETER status: {status}')
-        return resp
-
-    def get_status(self):
-        resp = self.ask('status')
-        logger.debug(f'Resposta do status: {resp}')
-        resp = resp.split(':')
-        loc = 0
-        for i in range(0, len(resp)):
-            if resp[i] == 'ACK':
-                loc = i + 1
-        return int(resp[loc])
-
-    def get_osa_trace(self, channel):
-        resp = self.ask(f'trace{channel}')
-        init = resp.find('ACK') + 4
-        resp = resp[init::]
-        resp = resp[:-2]
-        trace = resp.split(',')
-        trace = np.array(trace, dtype=float)
-        wl = np.linspace(1500, 1600, len(trace))
-
-        return np.append(wl.reshape(-1, 1),
-                         trace.reshape(-1, 1),
-                         axis=1)
-
-    def get_peaks(self, channel):
-        try:
-            lambdas = self.ask(f'bragg{channel}')
-        except Exception as e:
-            logger.error(f'Erro ao ler o Bragg: {e}')
-            self.start()
-            lambdas = self.ask(f'bragg{channel}')
-        i = lambdas.find('ACK') + 4
-        lambdas = lambdas[i:-2].split(',')
-        if len(lambdas) == 0:
-            return []
-        if lambdas[0] == '':
-            return []
-        return [float(lamb) if lamb else 0 for lamb in lambdas]
-
-
-class SimulateBraggMeter:
-    def __init__(self, sensors, variance=1, volatility=1e-6):
-        self.variance = None
-        self.volatility = None
-        self.sensors = None
-        self.set_simulation(sensors=sensors,
-                            variance=variance,
-                            volatility=volatility)
-
-    def set_simulation(self, sensors=None, variance=None, volatility=None):
-        if sensors is not None:
-            self.sensors = sensors
-        if variance is not None:
-            self.variance = variance
-        if volatility is not None:
-            self.volatility = volatility
-
-    def start(self):
-        pass
-
-    def stop(self):
-        pass
-
-    def send(self, msg):
-        pass
-
-    def ask(self, msg):
-        pass
-
-    def get_osa_trace(self, channel):
-        self.simulate_random_shift()
-        r = None
-        for sensor in self.sensors:
-            if r is None:
-                r = self.simulateFBGspectra(sensor.lambdaBragg)
-            else:
-                r += self.simulateFBGspectra(sensor.lambdaBragg)
-        return r
+class DeviceConnector(QObject):
+    # Abre e inicia os interrogadores numa thread, sem travar a interface;
+    # o resultado (a lista de interrogadores) chega pelos sinais na thread da interface
+    connected = pyqtSignal(object)
+    failed = pyqtSignal(str)
 
-    def get_peaks(self, channel):
-        self.simulate_random_shift()
-        peaks = []
-        for sensor in self.sensors:
-            peaks.append(sensor.lambdaBragg)
-        return peaks
+    def connect_device(self, factory):
+        # factory() retorna a lista de interrogadores já abertos
+        threading.Thread(target=self._run, args=(factory,), name='connect', daemon=True).start()
 
-    def simulate_random_shift(self):
-        for sensor in self.sensors:
-            sensor.lambdaBragg = sensor.lambdaBragg + \
-                                 sensor.lambdaBragg_0 * self.variance * np.random.randn() * self.volatility
-
-    def simulateFBGspectra(self, wl_bragg, wl=np.linspace(1500, 1600, 1000), A=1000, sigma=1):
-        return A * np.exp(((wl-wl_bragg)/(2*sigma))**2)
+    def _run(self, factory):
+        try:
+            devices = factory()
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        try:
+            for device in devices:
+                device.start()
+        except Exception as e:
+            for device in devices:
+                device.close()
+            self.failed.emit(str(e))
+            return
+        self.connected.emit(devices)
 
 
 class SpectrumAcquirer(QObject):
     spectra_signal = pyqtSignal(object)
     bragg_signal = pyqtSignal(object)
+    overload_signal = pyqtSignal(object)
 
-    def __init__(self, osa, interval, channels, *args, return_bragg=True, **kwargs):
+    def __init__(self, osa, interval, channels, *args, return_bragg=True, host_peaks=False,
+                 peak_method='parabolic', verify_peaks=False, queue_size=1024, dispatch_interval=50,
+                 start_device=True, policy='skip', **kwargs):
         super().__init__(*args, **kwargs)
-        self.osa = osa
+        # osa: um interrogador ou uma lista deles; com uma lista, channels tem uma
+        # lista de canais por interrogador e só os picos são lidos
+        self.osas = list(osa) if isinstance(osa, (list, tuple)) else [osa]
+        self.osa = self.osas[0]
 
         self.time_interval = interval
         self.channels = channels
+        self.return_bragg = return_bragg
+        # host_peaks: os picos são detectados aqui a partir do espectro completo;
+        # verify_peaks compara com os picos do próprio interrogador
+        self.peak_method = peak_method
+        self.verify_peaks = verify_peaks
+        self.discrepancy = None
+
+        if not return_bragg:
+            read = self.getSpectra
+        elif host_peaks:
+            read = self.getHostBragg
+        else:
+            read = self.getBragg
+
+        # A leitura roda na thread do worker; o timer só repassa os lotes prontos
+        # para a thread da interface
+        if len(self.osas) > 1:
+            if not return_bragg or host_peaks:
+                raise ValueError('Com vários interrogadores só os picos do próprio interrogador são lidos')
+            reads = [functools.partial(self.getDeviceBragg, d) for d in range(len(self.osas))]
+            recovers = [getattr(osa, 'recover', None) for osa in self.osas]
+            self.worker = MultiAcquisitionWorker(reads, self.time_interval, maxsize=queue_size,
+                                                 policy=policy, recovers=recovers)
+        else:
+            self.worker = AcquisitionWorker(read, self.time_interval, maxsize=queue_size, policy=policy,
+                                            recover=getattr(self.osa, 'recover', None))
 
         self.timer = QTimer()
-        if return_bragg:
-            self.timer.timeout.connect(self.getBragg)
-        else:
-            self.timer.timeout.connect(self.getSpectra)
-        self.timer.setInterval(self.time_interval * 1000)
+        self.timer.timeout.connect(self.dispatch)
+        self.timer.setInterval(dispatch_interval)
         self.timer.stop()
+        self.overload = None
 
-        try:
-            self.osa.start()
-        except Exception as e:
-            logger.error(f'Não foi possível iniciar o OSA: {e}')
+        if start_device:
+            for osa in self.osas:
+                try:
+                    osa.start()
+                except Exception as e:
+                    logger.error(f'Não foi possível iniciar o OSA: {e}')
 
     def setChannels(self, channels):
         self.channels = channels
 
     def pause(self):
         logger.debug('Pause loader')
-        if self.timer.isActive():
+        if self.worker.is_active():
+            self.worker.pause()
             self.timer.stop()
+            self.dispatch()
         else:
             logger.debug('Already stoped!')
 
     def resume(self):
         logger.debug('Resume loader')
-        if ~self.timer.isActive():
+        if not self.worker.is_active():
+            self.worker.start()
             self.timer.start()
         else:
             logger.debug('Already active!')
 
+    def dispatch(self):
+        overload = self.worker.overload()
+        if overload != self.overload:
+            self.overload = overload
+            self.overload_signal.emit(overload)
+        batch = self.worker.get_batch()
+        if len(batch) == 0:
+            return
+        if self.return_bragg:
+            self.bragg_signal.emit(batch)
+        else:
+            self.spectra_signal.emit(batch)
+
     def getSpectra(self):
         spectra = []
         for channel in self.channels:
             spectra.append(self.osa.get_osa_trace(channel))
-        self.spectra_signal.emit(spectra)
+        return spectra
 
     def getBragg(self):
         bragg = []
-        for channel in self.channels:
-            bragg.append(self.osa.get_peaks(channel))
-        self.bragg_signal.emit(bragg)
+        if hasattr(self.osa, 'get_all_peaks'):
+            bragg = self.osa.get_all_peaks(self.channels)
+        else:
+            for channel in self.channels:
+                bragg.append(self.osa.get_peaks(channel))
+        return bragg
+
+    def getDeviceBragg(self, device):
+        return self.osas[device].get_all_peaks(self.channels[device])
+
+    def getHostBragg(self):
+        traces = self.getSpectra()
+        wl = traces[0][:, 0]
+        bragg = detect_peaks(wl, np.stack([trace[:, 1] for trace in traces]), method=self.peak_method)
+        if self.verify_peaks:
+            device = self.getBragg()
+            self.discrepancy = [peak_discrepancy(ref, peaks) for ref, peaks in zip(device, bragg)]
+            worst = max((d.max() for d in self.discrepancy if len(d)), default=0)
+            logger.debug(f'Maior diferença entre picos do interrogador e do host: {worst * 1e3:.3f} pm')
+        return [peaks.tolist() for peaks in bragg]
 
     def kill(self):
         logger.debug('Killing loader')
-        self.osa.stop()
         self.timer.stop()
+        self.worker.stop(timeout=self.osa.timeout if hasattr(self.osa, 'timeout') else None)
+        for osa in self.osas:
+            try:
+                osa.stop()
+            except Exception as e:
+                logger.error(f'Erro ao parar o OSA: {e}')
+            osa.close()
+
+    def is_alive(self):
+        return self.worker.is_active()
+
+
+class StreamAcquirer(QObject):
+    # Mesmo papel do SpectrumAcquirer, mas as amostras vêm do stream do daemon
+    bragg_signal = pyqtSignal(object)
+    overload_signal = pyqtSignal(object)
+
+    def __init__(self, host, port, *args, dispatch_interval=50, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Só no modo --attach: o resto do daemon não entra na partida da interface
+        from daemon import StreamClient
+        self.client = StreamClient(host, port)
+        self.dropped = 0
+        self.channels = None
+        self.active = False
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.dispatch)
+        self.timer.setInterval(dispatch_interval)
+        self.timer.start()
+
+    def setChannels(self, channels):
+        self.channels = channels
+
+    def pause(self):
+        self.active = False
+
+    def resume(self):
+        self.client.get_batch()     # descarta o que chegou enquanto pausado
+        self.active = True
+
+    def dispatch(self):
+        if self.client.dropped != self.dropped:
+            self.dropped = self.client.dropped
+            self.overload_signal.emit({'dropped': self.dropped})
+        batch = self.client.get_batch()
+        if self.active and len(batch) > 0:
+            self.bragg_signal.emit(batch)
+
+    def kill(self):
+        self.timer.stop()
+        self.client.close()
+
+    def is_alive(self):
+        return self.active
+
+
+class ShmAcquirer(QObject):
+    # Lê o anel em memória compartilhada do daemon (shm.py) no mesmo ritmo do
+    # StreamAcquirer, mas sem socket nem JSON: as amostras já vêm casadas por sensor.
+    # Emite (horários, picos encontrados, Bragg do anel) e os nomes dos sensores do
+    # anel; quem recebe reordena para a sua planilha.
+    matched_signal = pyqtSignal(object)
+    overload_signal = pyqtSignal(object)
+
+    def __init__(self, name, *args, dispatch_interval=50, **kwargs):
+        super().__init__(*args, **kwargs)
+        from shm import RingReader
+        self.reader = RingReader(name)
+        self.lost = 0
+        self.active = False
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.dispatch)
+        self.timer.setInterval(dispatch_interval)
+        self.timer.start()
+
+    def setChannels(self, channels):
+        pass
+
+    def pause(self):
+        self.active = False
+
+    def resume(self):
+        self.reader.read()          # descarta o que chegou enquanto pausado
+        self.active = True
+
+    def dispatch(self):
+        timestamps, n_peaks, lambdaBragg = self.reader.read()
+        if self.reader.lost != self.lost:
+            self.lost = self.reader.lost
+            self.overload_signal.emit({'dropped': self.lost})
+        if self.active and len(timestamps) > 0:
+            self.matched_signal.emit((timestamps, n_peaks, lambdaBragg, self.reader.sensors))
+
+    def kill(self):
+        self.timer.stop()
+        self.reader.detach()
 
     def is_alive(self):
-        return self.timer.isActive()
+        return self.active
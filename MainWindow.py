@@ -1,21 +1,39 @@
-import os
 import datetime
+import os
+import threading
 from ui.ui_MainWindow import Ui_MainWindow
 from PyQt5.QtWidgets import QMainWindow
 import logging
-import pandas as pd
 import numpy as np
-from Loader import BraggMeter, SpectrumAcquirer, SimulateBraggMeter
-from sensor import StrainSensor, TemperatureSensor
-from pyqtgraph import mkColor, mkPen, PlotCurveItem, LegendItem
-from PyQt5 import QtCore, QtGui
+from Loader import BraggMeter, SpectrumAcquirer, StreamAcquirer, ShmAcquirer, DeviceConnector
+from acquisition import merge_channels
+from sensor_config import SensorConfigCache
+from buffer import SampleBuffer
+from aggregates import StreamingAggregator
+from storage import StorageWriter, BACKENDS, export_excel
+from pyqtgraph import mkColor, mkPen, PlotCurveItem, LegendItem, DateAxisItem
+from plotting import LivePlotter
+from diagnostics import DiagnosticsDock
+from readout import LiveReadout
+from alarms import AlarmEngine
+import metrics
+from PyQt5 import QtCore, QtGui, QtWidgets
 
 logger = logging.getLogger(__name__)
 
+CONVERT = metrics.histogram('convert_seconds', 'Casamento dos picos e conversão de um lote')
+
 simulation = False
 class MainWindow(Ui_MainWindow, QMainWindow):
-
-    def __init__(self, *args, **kwargs):
+    exported = QtCore.pyqtSignal(str)
+    # Períodos oferecidos na exportação para o Excel (None: tudo)
+    export_periods = {'Tudo': None, 'Última hora': datetime.timedelta(hours=1),
+                      'Últimas 24 horas': datetime.timedelta(days=1), 'Últimos 7 dias': datetime.timedelta(days=7),
+                      'Últimos 30 dias': datetime.timedelta(days=30)}
+
+    def __init__(self, *args, attach=None, **kwargs):
+        # attach: (host, porta) do stream de um daemon, ou o nome do seu anel em
+        # memória compartilhada; a janela só exibe, quem adquire e grava é o daemon
         super().__init__(*args, **kwargs)
 
         self.setupUi(self)
@@ -25,72 +43,163 @@ class MainWindow(Ui_MainWindow, QMainWindow):
         self.comboBox.model().item(2).setEnabled(True)
 
         self.setupGraph()
+        self.setupReadout()
 
         self.file2save = 'medições.xlsx'
+        self.storage_format = 'csv'  # 'brg' grava no formato binário compacto (codec.py)
+        self.storage = StorageWriter(BACKENDS[self.storage_format]('medições'))
+        self.exporting = False
+        self.exported.connect(self.statusbar.showMessage)
+        self.historyArchive = None      # um só por diretório: as importações não podem correr em paralelo
 
         self.comboBox.model().item(2).setEnabled(False)
 
-        if simulation:
-            self.braggmeter = SimulateBraggMeter(None)
-        else:
-            try:
-                self.braggmeter = BraggMeter(host='10.0.0.150', port=3500)
-            except Exception as e:
-                logger.error(f"Erro ao abrir o BraggMeter: {e}")
-                self.braggmeter = None
-
-        self.sensor_data = None
-        self.strain_sensors = None
-        self.temp_sensors = None
+        self.emulator = None
+        self.braggmeter = None
+        self.braggmeters = []
+        self.timedAcquirer = None
+        self.record = attach is None
+        # Um endereço por interrogador, na ordem da coluna Interrogador da planilha
+        self.hosts = [('10.0.0.150', 3500)]
+        self.time_interval = 1  # segundo, aceita frações a partir de 0.01
+        self.host_peaks = False  # True detecta os picos a partir do espectro completo
+        self.reconnect_interval = 10  # segundos entre tentativas de conexão
+        self.overload_policy = 'skip'  # 'skip', 'coalesce' ou 'adaptive' quando a leitura não cabe no período
+        self.alarm_debounce = 2  # amostras seguidas para disparar ou normalizar um alarme
+        self.alarm_latency_budget = 0.2  # segundos entre a resposta do interrogador e o alarme
+        self.closing = False
+
+        self.sensor_config = 'sensor_data.xlsx'
+        self.sensor_cache = SensorConfigCache()
+        self.sensors = None
+        self.curves = {}
         self.channels = None
 
-        if self.braggmeter is not None:
-            time_interval = 1  # segundo
-            self.timedAcquirer = SpectrumAcquirer(self.braggmeter, time_interval,
-                                                  self.channels, return_bragg=True)
-            self.timedAcquirer.bragg_signal.connect(self.processBragg)
+        self.deviceStatus = QtWidgets.QLabel()
+        self.statusbar.addPermanentWidget(self.deviceStatus)
+        self.alarmStatus = QtWidgets.QLabel()
+        self.statusbar.addPermanentWidget(self.alarmStatus)
+        self.alarms = None
+        if isinstance(attach, str):
+            self.setAcquirer(ShmAcquirer(attach))
+            self.deviceStatus.setText(f'Memória compartilhada: {attach}')
+        elif attach is not None:
+            self.setAcquirer(StreamAcquirer(*attach))
+            self.deviceStatus.setText(f'Stream: {attach[0]}:{attach[1]}')
+        else:
+            if simulation:
+                from emulator import BraggMeterEmulator
+                self.emulator = BraggMeterEmulator().start()
+                self.hosts = [(self.emulator.host, self.emulator.port)]
+            # A conexão roda em segundo plano: a janela aparece sem esperar o BraggMETER
+            self.connector = DeviceConnector()
+            self.connector.connected.connect(self.deviceConnected)
+            self.connector.failed.connect(self.deviceFailed)
+            self.connectDevice()
+
+        # Pré-carrega as abas de sensores depois que a janela já estiver na tela
+        QtCore.QTimer.singleShot(500, lambda: self.sensor_cache.watch(
+            self.sensor_config, [self.comboBox.itemText(i) for i in range(self.comboBox.count())]))
 
         self.data_buffer = None
+        self.aggregator = None
+        self.stream = None
+        self.record_raw = True  # False grava só os agregados (1 s, 1 min, 1 h)
+        self.flush_rows = 240
+        self.flush_interval = 600  # segundos
+
+    def connectDevice(self):
+        if self.closing:
+            return
+        self.deviceStatus.setText('BraggMETER: conectando...')
+        hosts = list(self.hosts)
+        self.connector.connect_device(lambda: self.openDevices(hosts))
+
+    @staticmethod
+    def openDevices(hosts):
+        devices = []
+        try:
+            for host, port in hosts:
+                devices.append(BraggMeter(host=host, port=port))
+        except Exception:
+            for device in devices:
+                device.close()
+            raise
+        return devices
+
+    def deviceConnected(self, braggmeters):
+        if self.closing:
+            for braggmeter in braggmeters:
+                braggmeter.close()
+            return
+        self.braggmeters = braggmeters
+        self.braggmeter = braggmeters[0]
+        self.setAcquirer(SpectrumAcquirer(braggmeters if len(braggmeters) > 1 else self.braggmeter,
+                                          self.time_interval, self.channels, return_bragg=True,
+                                          host_peaks=self.host_peaks, start_device=False,
+                                          policy=self.overload_policy))
+        self.deviceStatus.setText(f'BraggMETER: conectado ({", ".join(host for host, _ in self.hosts)})')
+
+    def deviceFailed(self, message):
+        logger.error(f"Erro ao abrir o BraggMeter: {message}")
+        self.deviceStatus.setText('BraggMETER: desconectado')
+        QtCore.QTimer.singleShot(self.reconnect_interval * 1000, self.connectDevice)
+
+    def setAcquirer(self, acquirer):
+        self.timedAcquirer = acquirer
+        if isinstance(acquirer, ShmAcquirer):
+            self.timedAcquirer.matched_signal.connect(self.processMatched)
+        else:
+            self.timedAcquirer.bragg_signal.connect(self.processBragg)
+        self.timedAcquirer.overload_signal.connect(self.reportOverload)
 
     def setupSensors(self, config_path, sheet, plot=True):
-        self.sensor_data = pd.read_excel(config_path, sheet_name=sheet)
-        self.channels = self.sensor_data['Canal'].unique().tolist()
-        logger.debug(f'Sensores: \n{self.sensor_data}')
-        self.strain_sensors = []
-        self.temp_sensors = []
+        sensors = self.sensor_cache.get(config_path, sheet)
+        if sensors is not self.sensors:
+            logger.debug(f'Sensores: {sensors.names.tolist()}')
+            self.sensors = sensors
+            self.channels = self.sensors.acquisition_channels()
+            self.strain_idx = np.flatnonzero(self.sensors.is_strain)
+            self.readout.set_sensors(self.sensors)
+            self.alarms = AlarmEngine(self.sensors, debounce=self.alarm_debounce,
+                                      latency_budget=self.alarm_latency_budget)
+            self.alarmStatus.clear()
+            if self.data_buffer is not None:
+                self.aggregator.close()
+                self.flushData()
+            self.stream = sheet
+            self.data_buffer = SampleBuffer(self.sensors.columns(),
+                                            flush_rows=self.flush_rows,
+                                            flush_interval=self.flush_interval)
+            self.aggregator = StreamingAggregator(self.data_buffer.columns)
+            if self.emulator is not None:
+                self.emulator.set_sensors(self.sensors.lambdaBragg_0, self.sensors.channels)
+
         colors = ['k', 'b', 'c', 'r', 'g', 'y']
-        ci = 0
-        for i in range(0, len(self.sensor_data)):
-            sensor = self.sensor_data.iloc[i, :]
-            logger.debug(sensor)
-            if sensor['Tipo'] == 'Temperatura':
-                self.temp_sensors.append(
-                    TemperatureSensor(sensor['Sensor'],
-                                      (None, None),
-                                      sensor.to_dict())
-                )
-            if sensor['Tipo'] == 'Deformação':
-                self.strain_sensors.append(
-                    StrainSensor(sensor['Sensor'],
-                                 (None, None),
-                                 sensor.to_dict())
-                )
-                if plot:
-                    self.strain_sensors[-1].curve_item = self.plotNewCurve([], [],
-                                                                           name=self.strain_sensors[-1].name,
-                                                                           pen=mkPen(color=colors[ci],
-                                                                                     width=2)
-                                                                           )
-                ci += 1
-        if simulation:
-            sensors = []
-            for sensor in self.temp_sensors:
-                sensors.append(sensor)
-            for sensor in self.strain_sensors:
-                sensors.append(sensor)
-            self.braggmeter.set_simulation(sensors=sensors)
+        if plot:
+            self.curves = {}
+            for ci, i in enumerate(self.strain_idx):
+                self.curves[i] = self.plotNewCurve([], [],
+                                                   name=self.sensors.names[i],
+                                                   pen=mkPen(color=colors[ci % len(colors)],
+                                                             width=2)
+                                                   )
+            self.plotter.set_curves([self.curves[i] for i in self.strain_idx])
 
     def connectActions(self):
+        menu = self.menubar.addMenu('Arquivo')
+        menu.addAction('Exportar para Excel...', self.exportExcel)
+        menu.addAction('Histórico...', self.openHistory)
+
+        self.diagnostics = DiagnosticsDock(self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.diagnostics)
+        self.diagnostics.hide()
+        view = self.menubar.addMenu('Exibir')
+        view.addAction(self.diagnostics.toggleViewAction())
+        collect = view.addAction('Coletar métricas')
+        collect.setCheckable(True)
+        collect.setChecked(metrics.REGISTRY.enabled)
+        collect.toggled.connect(metrics.set_enabled)
         self.pushButton.clicked.connect(self.sendString)
         self.pushButton_oneshot.clicked.connect(self.measure)
         self.pushButton_continuous.clicked.connect(self.continuousMeasure)
@@ -99,6 +208,7 @@ class MainWindow(Ui_MainWindow, QMainWindow):
         logger.debug('Setup plotWidget da série temporal')
         bg_color = self.palette().color(QtGui.QPalette.Window)
         self.graphWidget.setBackground(mkColor('white'))
+        self.graphWidget.setAxisItems({'bottom': DateAxisItem()})
         self.graphWidget.getAxis('left').setLabel('Deformação (ue)')
         self.graphWidget.getAxis('bottom').setLabel('Horário')
         self.graphWidget.plotItem.vb.setLimits()
@@ -108,6 +218,16 @@ class MainWindow(Ui_MainWindow, QMainWindow):
         self.legend = LegendItem(offset=[0, 10])
         self.legend.setParentItem(self.graphWidget.plotItem)
 
+        self.plotter = LivePlotter(self.graphWidget)
+
+    def setupReadout(self):
+        # Tabela com os últimos valores acima do histórico (plainTextEdit_2), que fica limitado
+        self.readoutTable = QtWidgets.QTableWidget(self.centralwidget)
+        self.readoutTable.setMinimumHeight(150)
+        layout = self.verticalLayout_2
+        layout.insertWidget(layout.indexOf(self.plainTextEdit_2), self.readoutTable)
+        self.readout = LiveReadout(self.readoutTable, self.plainTextEdit_2)
+
     def plotNewCurve(self, x, y, name=None, **kwargs):
         logger.debug(('Plotar uma nova curva'))
         curve = PlotCurveItem(x=x, y=y, clickable=True, **kwargs)
@@ -129,205 +249,199 @@ class MainWindow(Ui_MainWindow, QMainWindow):
         if self.braggmeter is None:
             logger.error('BraggMeter não conectado!')
             return -1
-        self.setupSensors('sensor_data.xlsx', self.comboBox.currentText(), plot=False)
-        resp = self.braggmeter.send(f':ACQU:STAR\r\n'.encode())
-        logger.info(resp)
-        sensors = []
-        for channel in self.channels:
-            logger.debug(f'Canal : {channel}')
-            lambdas = self.braggmeter.get_peaks(channel)
-            sensors.extend(lambdas)
-        sensors = np.array(sensors)
-        sensors.sort()
-        self.lambda2Measurement(sensors, plot=False)
+        self.setupSensors(self.sensor_config, self.comboBox.currentText(), plot=False)
+        if not self.checkDevices():
+            return -1
+        try:
+            for braggmeter in self.braggmeters:
+                resp = braggmeter.send(f':ACQU:STAR\r\n'.encode())
+                logger.info(resp)
+            if self.sensors.multi_device:
+                data = [braggmeter.get_all_peaks(channels)
+                        for braggmeter, channels in zip(self.braggmeters, self.channels)]
+            else:
+                data = self.braggmeter.get_all_peaks(self.channels)
+        except Exception as e:
+            logger.error(f'Erro ao ler o Bragg: {e}')
+            self.statusbar.showMessage(f'Erro ao ler o BraggMETER: {e}')
+            return -1
+        timestamp = datetime.datetime.now()
+        self.lambda2Measurement([data], [timestamp], plot=False)
+
+    def checkDevices(self):
+        # A planilha tem que usar tantos interrogadores quantos estão conectados
+        n = len(self.sensors.device_list())
+        if self.braggmeters and len(self.braggmeters) != n:
+            logger.error(f'A aba {self.comboBox.currentText()} usa {n} interrogador(es), '
+                         f'mas {len(self.braggmeters)} estão configurados')
+            self.statusbar.showMessage('Número de interrogadores diferente do da planilha')
+            return False
+        return True
 
     def continuousMeasure(self):
-        if self.braggmeter is None:
+        if self.timedAcquirer is None:
             logger.error('BraggMeter não conectado!')
             return -1
 
         if self.timedAcquirer.is_alive():
             self.pushButton_continuous.setText("Iniciar medição contínua")
             self.timedAcquirer.pause()
-            if self.data_buffer is not None:
-                self.appendData2Excel()
+            if self.data_buffer is not None and self.data_buffer.pending > 0:
+                self.flushData()
         else:
             self.pushButton_continuous.setText("Parar medição contínua")
             self.graphWidget.removeItem(self.legend)
             self.graphWidget.clear()
             self.legend.clear()
 
-            self.setupSensors('sensor_data.xlsx', self.comboBox.currentText())
+            self.setupSensors(self.sensor_config, self.comboBox.currentText())
+            if not self.checkDevices():
+                self.pushButton_continuous.setText("Iniciar medição contínua")
+                return -1
             self.timedAcquirer.setChannels(self.channels)
             self.timedAcquirer.resume()
 
-    def processBragg(self, bragg_per_ch):
-        sensors = []
-        for bragg_list in bragg_per_ch:
-            sensors.extend(bragg_list)
-        sensors = np.array(sensors)
-        sensors.sort()
-        self.lambda2Measurement(sensors)
-
-    def lambda2Measurement(self, lambdas, plot=True):
-        cursor = QtGui.QTextCursor(self.plainTextEdit_2.document())
-        cursor.setPosition(0)
-        self.plainTextEdit_2.setTextCursor(cursor)
-
-        measured_data = {'Horário': datetime.datetime.now()}
-        self.plainTextEdit_2.insertPlainText(f"Timestamp \t\t {measured_data['Horário']}\n")
-
-        if len(lambdas) == 0:
+    def processBragg(self, batch):
+        self.lambda2Measurement([sample.data for sample in batch],
+                                [sample.timestamp for sample in batch])
+
+    def processMatched(self, batch):
+        # Lote lido do anel do daemon, já casado com os sensores dele: só reordena
+        # pelos nomes para a aba atual (sensor que o daemon não tem fica sem pico)
+        timestamps, n_peaks, ring_lambda, names = batch
+        t0 = metrics.clock()
+        position = {name: k for k, name in enumerate(names)}
+        source = np.array([position.get(str(name), -1) for name in self.sensors.names])
+        lambdaBragg = np.where(source >= 0, ring_lambda[:, source], 0)
+        self.convertMeasurement(lambdaBragg, n_peaks, [datetime.datetime.fromtimestamp(t) for t in timestamps],
+                                t0=t0)
+
+    def reportOverload(self, overload):
+        labels = {'missed': 'ticks perdidos', 'coalesced': 'ticks agrupados', 'rate_changes': 'ajustes de taxa',
+                  'dropped': 'amostras descartadas', 'failures': 'falhas de leitura',
+                  'skipped': 'ticks pulados', 'partial': 'amostras parciais'}
+        parts = [f'{label}: {overload[key]}' for key, label in labels.items() if overload.get(key)]
+        if overload.get('period', self.time_interval) != self.time_interval:
+            parts.append(f"período: {overload['period']:g} s")
+        if overload.get('recovering'):
+            parts.insert(0, 'recuperando o BraggMETER')
+        self.statusbar.showMessage(', '.join(parts))
+
+    def lambda2Measurement(self, samples, timestamps, plot=True):
+        # Converte um lote de amostras de uma vez: samples[j] são os picos por canal
+        # (ou por interrogador e canal) da amostra j
+        t0 = metrics.clock()
+        lambdaBragg = self.sensors.match_samples(samples)
+        n_peaks = [len(merge_channels(sample)) for sample in samples]
+        self.convertMeasurement(lambdaBragg, n_peaks, timestamps, plot, t0)
+
+    def convertMeasurement(self, lambdaBragg, n_peaks, timestamps, plot=True, t0=None):
+        # lambdaBragg (amostras x sensores da aba atual); n_peaks[j] é o total de picos da amostra j
+        t0 = metrics.clock() if t0 is None else t0
+        temperature, mean_temperature, strain = self.sensors.convert(lambdaBragg)
+        CONVERT.observe_since(t0)
+        epoch = [timestamp.timestamp() for timestamp in timestamps]
+        # Alarmes antes de qualquer outra coisa, para não esperar a tela nem o disco
+        events = self.alarms.evaluate(epoch, lambdaBragg, temperature, strain)
+        if events:
+            self.reportAlarms(events)
+        if not all(n_peaks):
             logger.error("FALHA MÁXIMA NA AQUISIÇÃO!!!!!!")
-            self.plainTextEdit_2.insertPlainText(f"FALHA MÁXIMA NA AQUISIÇÃO!!!!!!\n")
-
-        self.plainTextEdit_2.insertPlainText(f"Bragg \t\t {lambdas}")
-        self.plainTextEdit_2.insertPlainText("\n")
-
-        for sensor in self.temp_sensors:
-            dist = np.abs(lambdas - sensor.lambdaBragg_0)
-            if len(dist) != 0:
-                i = dist.argmin()
-                if dist[i] < 2.5:        # Distância máxima: 2.5nm
-                    sensor.lambdaBragg = lambdas[i]
-                else:
-                    sensor.lambdaBragg = 0
-            else:
-                sensor.lambdaBragg = 0
-            
-        for sensor in self.strain_sensors:
-            dist = np.abs(lambdas - sensor.lambdaBragg_0)
-            if len(dist) != 0:
-                i = dist.argmin()
-                if dist[i] < 2.5:        # Distância máxima: 2.5nm
-                    sensor.lambdaBragg = lambdas[i]
-                else:
-                    sensor.lambdaBragg = 0
-            else:
-                sensor.lambdaBragg = 0
-            
-        temp = 0
-        working_temp_sensors = 0
-
-        for temp_sen in self.temp_sensors:
-            temp_i = temp_sen.getTemperature()
-            sensor_ref = temp_sen.param_dict['Sensor']
-            measured_data[f'Bragg (nm) @ {sensor_ref}'] = temp_sen.lambdaBragg
-            measured_data[f'Temperatura (°C) @ {sensor_ref}'] = temp_i
-
-            if temp_sen.lambdaBragg != 0:
-                temp += temp_i
-                working_temp_sensors += 1
-
-        if working_temp_sensors != 0:
-            temp = temp / working_temp_sensors
-        else:
-            temp = None
-
-        self.plainTextEdit_2.insertPlainText(f"Temperatura \t\t {temp} °C")
-        self.plainTextEdit_2.insertPlainText("\n")
-        measured_data['Temperatura (°C)'] = temp
-
-        for strain_sen in self.strain_sensors:
-            sensor_ref = strain_sen.param_dict['Sensor']
-            strain = strain_sen.getStrain(temperature=temp)
-            measured_data[f'Bragg (nm) @ {sensor_ref}'] = strain_sen.lambdaBragg
-            measured_data[f'Strain (ue) @ {sensor_ref}'] = strain
-
-            if plot:
-                self.plot_strain(strain_sen)
-
-            self.plainTextEdit_2.insertPlainText(f"Strain@{strain_sen.name} \t\t {strain} ue")
-            self.plainTextEdit_2.insertPlainText("\n")
-        self.plainTextEdit_2.insertPlainText("____________________________________________________\n")
-
-        df = pd.DataFrame(measured_data, index=[0])
-        if self.data_buffer is None:
-            self.data_buffer = df
+        self.readout.update(timestamps, n_peaks, lambdaBragg, temperature, mean_temperature, strain)
+
+        if plot:
+            self.plotter.append(epoch, strain[:, self.strain_idx])
+        rows = self.sensors.table(lambdaBragg, temperature, mean_temperature, strain)
+        self.data_buffer.extend(epoch, rows)
+        self.aggregator.update(epoch, rows)
+        if self.data_buffer.should_flush():
+            self.flushData()
+
+    def reportAlarms(self, events):
+        self.alarms.log(events)
+        self.statusbar.showMessage(AlarmEngine.describe(events[-1]))
+        active = self.alarms.current()
+        if active:
+            self.alarmStatus.setStyleSheet('color: red; font-weight: bold')
+            self.alarmStatus.setText('Alarmes: ' + ', '.join(f'{name} ({kind})' for name, kind in active))
         else:
-            self.data_buffer = pd.concat([self.data_buffer, df], ignore_index=True)
-
-        if len(self.data_buffer) > 240:
-            self.appendData2Excel()
-
-    def appendData2Excel(self):
-        self.thread = QtCore.QThread()
-        self.worker = ExcelDumper()
-        self.worker.setup(self.file2save, self.data_buffer, self.comboBox.currentText())
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.worker.file_changed.connect(self.update_file)
-        self.thread.start()
-        self.data_buffer = None
-
-    def update_file(self, file_name):
-        self.file2save = file_name
-
-    def plot_strain(self, sensor):
-        max_xaxis = 50
-        xData, yData = sensor.curve_item.getData()
-        if len(xData) > max_xaxis:
-            xData = xData[-max_xaxis::]
-            yData = yData[-max_xaxis::]
-            xmin = xData[-max_xaxis]
-            xmax = xData[-1] + 10
-
-            self.graphWidget.setXRange(xmin, xmax, padding=0, update=False)
-        # NOTE usar o timestamp (sec + 60*min + 3600*h) deve arrumar o delay introduzido por falha
-        if len(xData) == 0:
-            x = 0
-        else:
-            x = xData[-1] + 1
-        sensor.curve_item.updateData(np.append(xData, x), np.append(yData, sensor.strain))
+            self.alarmStatus.clear()
+
+    def flushData(self):
+        timestamps, data = self.data_buffer.unflushed()
+        tiers = self.aggregator.drain()
+        if self.record:
+            if self.record_raw and len(timestamps) > 0:
+                self.storage.submit(self.stream, self.data_buffer.columns, timestamps, data)
+            for label, tier_timestamps, tier_rows in tiers:
+                self.storage.submit(f'{self.stream}_{label}', self.aggregator.columns, tier_timestamps, tier_rows)
+        self.data_buffer.mark_flushed()
+
+    def exportExcel(self):
+        if self.data_buffer is not None and self.data_buffer.pending > 0:
+            self.flushData()
+        self.storage.flush()
+        if self.exporting:
+            self.statusbar.showMessage('Exportação para o Excel já em andamento')
+            return
+        period, ok = QtWidgets.QInputDialog.getItem(self, 'Exportar para Excel', 'Período:',
+                                                    list(self.export_periods), 0, False)
+        if not ok:
+            return
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Exportar para Excel', self.file2save,
+                                                        'Excel (*.xlsx)')
+        if not path:
+            return
+        self.file2save = path
+        span = self.export_periods[period]
+        start = datetime.datetime.now() - span if span is not None else None
+        # Meses de medição levam minutos: a exportação roda fora da thread da interface
+        self.exporting = True
+        self.statusbar.showMessage(f'Exportando para {path}...')
+        threading.Thread(target=self._export, args=(self.storage.backend.list_files(), path, start),
+                         name='export', daemon=True).start()
+
+    def _export(self, paths, path, start):
+        try:
+            rows = export_excel(paths, path, start=start)
+            self.exported.emit(f'{rows} linhas exportadas para {path}')
+        except Exception as e:
+            logger.error(f'Erro ao exportar: {e}')
+            self.exported.emit(f'Erro ao exportar para {path}, veja o log')
+        finally:
+            self.exporting = False
+
+    def openHistory(self):
+        # Importa o que foi gravado até agora e abre a janela de histórico
+        from history import HistoryArchive
+        from history_window import HistoryWindow
+        if self.data_buffer is not None and self.data_buffer.pending > 0:
+            self.flushData()
+        self.storage.flush()
+        backend = self.storage.backend
+        root = os.path.join(backend.directory, '.historico')
+        if self.historyArchive is None or self.historyArchive.root != root:
+            self.historyArchive = HistoryArchive(root)
+        self.historyWindow = HistoryWindow(backend.list_files(), self.historyArchive, self)
+        self.historyWindow.show()
 
     def closeEvent(self, ev):
+        self.closing = True
         try:
-            if self.braggmeter is not None:
+            if self.timedAcquirer is not None:
                 self.timedAcquirer.kill()
                 self.timedAcquirer = None
                 self.braggmeter = None
+                self.braggmeters = []
         except Exception as e:
             logger.error(f'Erro ao fechar o aquisitor: {e}')
+        if self.data_buffer is not None:
+            self.aggregator.close()
+            self.flushData()
+        self.storage.close()
+        self.plotter.stop()
+        self.readout.stop()
+        self.sensor_cache.stop()
+        if self.emulator is not None:
+            self.emulator.stop()
         ev.accept()
-
-class ExcelDumper(QtCore.QObject):
-    file_changed = QtCore.pyqtSignal(object)
-    finished = QtCore.pyqtSignal()
-
-    def setup(self, file_path, data, sheet_name):
-        self.file_path = file_path
-        self.data = data
-        self.sheet_name = sheet_name
-
-    def run(self):
-        try:
-            self.appendData2Excel()
-        except Exception as e:
-            logger.error(f'Erro ao salvar: {e}')
-            k = 0
-            fname = f'medições{k}.xlsx'
-            while os.path.isfile(fname):
-                k += 1
-                fname = f'medições{k}.xlsx'
-            self.file_path = fname
-            self.appendData2Excel()
-            self.file_changed.emit(fname)
-        self.finished.emit()
-
-    def appendData2Excel(self):
-        file_exists = os.path.isfile(self.file_path)
-        mode = 'a' if file_exists else 'w'
-        if_sheet_exists = 'overlay' if file_exists else None
-
-        with pd.ExcelWriter(self.file_path, mode=mode, if_sheet_exists=if_sheet_exists) as writer:
-            startrow = writer.sheets[self.sheet_name].max_row if file_exists else 1
-            if startrow == 1:
-                startrow = 0
-                header = True
-            else:
-                header = False
-            self.data.to_excel(writer, sheet_name=self.sheet_name,
-                        startrow=startrow, index=False, header=header)
\ No newline at end of file
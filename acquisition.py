@@ -0,0 +1,361 @@
+import collections
+import datetime
+import math
+import queue
+import threading
+import time
+import logging
+from collections import namedtuple
+import numpy as np
+import metrics
+
+logger = logging.getLogger(__name__)
+
+READ = metrics.histogram('acquisition_read_seconds', 'Leitura completa de um tick')
+SAMPLES = metrics.counter('acquisition_samples_total', 'Amostras adquiridas')
+MISSED = metrics.counter('acquisition_ticks_missed_total', 'Ticks perdidos por atraso da leitura')
+DROPPED = metrics.counter('acquisition_samples_dropped_total', 'Amostras descartadas com a fila cheia')
+PARTIAL = metrics.counter('acquisition_partial_samples_total', 'Amostras alinhadas sem algum interrogador')
+COALESCED = metrics.counter('acquisition_ticks_coalesced_total', 'Ticks atrasados agrupados num só')
+RATE_CHANGES = metrics.counter('acquisition_rate_changes_total', 'Mudanças do período pela política adaptativa')
+FAILURES = metrics.counter('acquisition_read_failures_total', 'Leituras do interrogador com erro')
+RECOVERIES = metrics.counter('acquisition_recovery_attempts_total', 'Tentativas de recuperar o interrogador')
+SKIPPED = metrics.counter('acquisition_ticks_skipped_total', 'Ticks pulados enquanto o interrogador se recupera')
+
+# timestamp: instante em que a resposta do interrogador chegou
+Sample = namedtuple('Sample', ['timestamp', 'data'])
+
+
+def merge_channels(bragg_per_ch):
+    # Junta os picos de todos os canais numa lista ordenada. Aceita também
+    # picos por canal de vários interrogadores (None para um que faltou).
+    lambdas = []
+    for bragg_list in bragg_per_ch:
+        if bragg_list is None:
+            continue
+        if any(isinstance(b, (list, tuple, np.ndarray)) for b in bragg_list):
+            lambdas.extend(merge_channels(bragg_list))
+        else:
+            lambdas.extend(bragg_list)
+    lambdas = np.array(lambdas, dtype=float)
+    lambdas.sort()
+    return lambdas
+
+
+class Scheduler:
+    # Agenda ticks numa grade fixa t0 + n * period sobre o relógio monotônico,
+    # então atrasos de um tick não se acumulam nos seguintes.
+    # Quando uma leitura passa do período (sobrecarga), a política decide:
+    #   skip      pula os ticks perdidos e espera o próximo da grade
+    #   coalesce  os ticks perdidos viram um só, disparado na hora; a grade recomeça dali
+    #   adaptive  pula como skip e aumenta o período (múltiplo do nominal) enquanto as
+    #             leituras não couberem nele, voltando aos poucos quando sobrar folga
+    min_period = 0.01
+    policies = ('skip', 'coalesce', 'adaptive')
+
+    def __init__(self, period, clock=time.monotonic, policy='skip', max_period=None):
+        if period < self.min_period:
+            raise ValueError(f'Período mínimo de aquisição é {self.min_period} s')
+        if policy not in self.policies:
+            raise ValueError(f'Política de sobrecarga desconhecida: {policy}')
+        self.nominal = period
+        self.period = period
+        self.max_period = max_period if max_period is not None else max(60 * period, 10)
+        self.policy = policy
+        self.clock = clock
+        self.missed = 0
+        self.coalesced = 0
+        self.rate_changes = 0
+        self.deadline = None
+
+    def reset(self):
+        self.deadline = self.clock()
+        self.period = self.nominal
+
+    def adapt(self, busy):
+        # busy: duração da última leitura
+        steps = round(self.period / self.nominal)
+        if busy > self.period:
+            steps = math.ceil(busy * 1.25 / self.nominal)
+        elif busy < self.period / 2 and steps > 1:
+            steps = max(1, math.floor(steps * 0.8))
+        period = min(self.max_period, steps * self.nominal)
+        if period != self.period:
+            self.rate_changes += 1
+            RATE_CHANGES.inc()
+            logger.info(f'Período de aquisição ajustado de {self.period:g} s para {period:g} s')
+            self.period = period
+
+    def next_delay(self, busy=None):
+        # Retorna quanto esperar até o próximo tick e quantos ticks foram perdidos
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+            return 0, 0
+        if self.policy == 'adaptive' and busy is not None:
+            self.adapt(busy)
+        lost = int((now - self.deadline) // self.period)
+        if lost < 0:
+            lost = 0
+        if lost and self.policy == 'coalesce':
+            self.coalesced += lost
+            COALESCED.inc(lost)
+            self.deadline = now
+            return 0, 0
+        self.deadline += (lost + 1) * self.period
+        self.missed += lost
+        return self.deadline - now, lost
+
+
+class AcquisitionWorker:
+    # Roda a leitura do interrogador numa thread própria e entrega os
+    # resultados por uma fila limitada; quando a fila enche, descarta o mais antigo.
+    # Se a leitura falhar, recover() roda numa thread à parte, com espera exponencial
+    # entre as tentativas (backoff), e os ticks são pulados até ela dar certo.
+    def __init__(self, read, interval, maxsize=1024, policy='skip', recover=None, backoff=(1, 30)):
+        self.read = read
+        self.recover = recover
+        self.backoff = backoff
+        self.scheduler = Scheduler(interval, policy=policy)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.failures = 0
+        self.skipped = 0
+        self.recoveries = 0
+        self.recovering = threading.Event()
+        metrics.gauge('acquisition_queue_depth', 'Amostras esperando na fila de aquisição', fn=self.queue.qsize)
+        metrics.gauge('acquisition_period_seconds', 'Período de aquisição em uso', fn=lambda: self.scheduler.period)
+
+        self._active = threading.Event()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._active.set()
+        self.scheduler.reset()
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='acquisition', daemon=True)
+            self.thread.start()
+
+    def pause(self):
+        self._active.clear()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._active.set()      # acorda a thread se estiver pausada
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self._active.clear()
+
+    def is_active(self):
+        return self._active.is_set() and not self._stop.is_set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._active.wait()
+            if self._stop.is_set():
+                break
+            t0 = time.monotonic()
+            if self.recovering.is_set():
+                self.skipped += 1
+                SKIPPED.inc()
+            else:
+                try:
+                    data = self.read()
+                    READ.observe(time.monotonic() - t0)
+                    self._put(Sample(datetime.datetime.now(), data))
+                    SAMPLES.inc()
+                except Exception as e:
+                    self.failures += 1
+                    FAILURES.inc()
+                    logger.error(f'Erro na aquisição: {e}')
+                    if self.recover is not None:
+                        self.recovering.set()
+                        threading.Thread(target=self._recover, name='recovery', daemon=True).start()
+            delay, lost = self.scheduler.next_delay(time.monotonic() - t0)
+            if lost:
+                MISSED.inc(lost)
+                logger.warning(f'{lost} ticks de aquisição perdidos (total {self.scheduler.missed})')
+            self._stop.wait(delay)
+
+    def _recover(self):
+        delay = self.backoff[0]
+        try:
+            while not self._stop.is_set():
+                self.recoveries += 1
+                RECOVERIES.inc()
+                try:
+                    self.recover()
+                    logger.info('Interrogador recuperado')
+                    return
+                except Exception as e:
+                    logger.warning(f'Falha ao recuperar o interrogador ({e}), nova tentativa em {delay} s')
+                if self._stop.wait(delay):
+                    return
+                delay = min(2 * delay, self.backoff[1])
+        finally:
+            self.recovering.clear()
+
+    @property
+    def missed(self):
+        return self.scheduler.missed
+
+    def overload(self):
+        # Contadores de sobrecarga e falha, para exibir
+        return {'missed': self.scheduler.missed, 'coalesced': self.scheduler.coalesced,
+                'rate_changes': self.scheduler.rate_changes, 'period': self.scheduler.period,
+                'dropped': self.dropped, 'failures': self.failures, 'skipped': self.skipped,
+                'recovering': self.recovering.is_set()}
+
+    def _put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    DROPPED.inc()
+                    logger.warning(f'Fila de aquisição cheia, amostra descartada ({self.dropped})')
+                except queue.Empty:
+                    pass
+
+    def wait_batch(self, timeout=None):
+        # Bloqueia até haver ao menos uma amostra (ou timeout) e então drena a fila
+        try:
+            first = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        return [first] + self.get_batch()
+
+    def get_batch(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+
+class TimeAligner:
+    # Junta as amostras de vários interrogadores cujos horários distam no máximo
+    # tolerance segundos da mais antiga. As amostras de cada interrogador chegam em
+    # ordem, então se um deles já tem uma amostra mais nova, a que faltava não vem
+    # mais; se ele não tem nada, espera-se até max_wait antes de seguir sem ele.
+    def __init__(self, n_devices, tolerance, max_wait):
+        self.tolerance = tolerance
+        self.max_wait = max_wait
+        self.pending = [collections.deque() for _ in range(n_devices)]
+        self.partial = 0
+
+    def add(self, device, sample):
+        self.pending[device].append(sample)
+
+    def pop(self, now):
+        # Retorna as amostras alinhadas prontas; data[d] é o dado do interrogador d ou None
+        aligned = []
+        while True:
+            heads = [q[0] if q else None for q in self.pending]
+            present = [head.timestamp for head in heads if head is not None]
+            if not present:
+                return aligned
+            ref = min(present)
+            if len(present) < len(heads) and (now - ref).total_seconds() < self.max_wait:
+                return aligned
+            data = []
+            stamps = []
+            for q, head in zip(self.pending, heads):
+                if head is not None and (head.timestamp - ref).total_seconds() <= self.tolerance:
+                    q.popleft()
+                    data.append(head.data)
+                    stamps.append(head.timestamp.timestamp())
+                else:
+                    data.append(None)
+            if len(stamps) < len(heads):
+                self.partial += 1
+                PARTIAL.inc()
+            aligned.append(Sample(datetime.datetime.fromtimestamp(sum(stamps) / len(stamps)), data))
+
+
+class MultiAcquisitionWorker:
+    # Um AcquisitionWorker por interrogador, cada um com a sua thread e a sua sessão,
+    # então as idas e voltas se sobrepõem em vez de se somar. As amostras saem
+    # alinhadas no tempo pelo TimeAligner. Mesma interface do AcquisitionWorker.
+    def __init__(self, reads, interval, tolerance=None, max_wait=None, maxsize=1024, policy='skip',
+                 recovers=None, backoff=(1, 30)):
+        # recovers[d]: recuperação do interrogador d (ou None)
+        recovers = recovers if recovers is not None else [None] * len(reads)
+        self.workers = [AcquisitionWorker(read, interval, maxsize=maxsize, policy=policy,
+                                          recover=recover, backoff=backoff)
+                        for read, recover in zip(reads, recovers)]
+        if tolerance is None:
+            tolerance = interval / 2
+        if max_wait is None:
+            max_wait = max(2 * interval, tolerance)
+        self.aligner = TimeAligner(len(reads), tolerance, max_wait)
+        self.poll_interval = min(tolerance, 0.05)
+        self.lock = threading.Lock()
+        metrics.gauge('acquisition_queue_depth', 'Amostras esperando na fila de aquisição',
+                      fn=lambda: sum(worker.queue.qsize() for worker in self.workers))
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def pause(self):
+        for worker in self.workers:
+            worker.pause()
+
+    def stop(self, timeout=None):
+        for worker in self.workers:
+            worker._stop.set()
+        for worker in self.workers:
+            worker.stop(timeout)
+
+    def is_active(self):
+        return any(worker.is_active() for worker in self.workers)
+
+    @property
+    def missed(self):
+        return sum(worker.missed for worker in self.workers)
+
+    @property
+    def dropped(self):
+        return sum(worker.dropped for worker in self.workers)
+
+    @property
+    def partial(self):
+        return self.aligner.partial
+
+    def overload(self):
+        total = {}
+        for worker in self.workers:
+            for key, value in worker.overload().items():
+                if key == 'period':
+                    total[key] = max(total.get(key, 0), value)
+                elif key == 'recovering':
+                    total[key] = total.get(key, False) or value
+                else:
+                    total[key] = total.get(key, 0) + value
+        total['partial'] = self.aligner.partial
+        return total
+
+    def wait_batch(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            batch = self.get_batch()
+            if batch or (deadline is not None and time.monotonic() >= deadline):
+                return batch
+            time.sleep(self.poll_interval)
+
+    def get_batch(self):
+        with self.lock:
+            for d, worker in enumerate(self.workers):
+                for sample in worker.get_batch():
+                    self.aligner.add(d, sample)
+            # Parado ou pausado, nada mais vai chegar: libera o que estiver esperando
+            now = datetime.datetime.now() if self.is_active() else datetime.datetime.max
+            return self.aligner.pop(now)
@@ -0,0 +1,103 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# (segundos, rótulo usado no nome do fluxo gravado)
+DEFAULT_TIERS = ((1, '1s'), (60, '1min'), (3600, '1h'))
+STATS = ('n', 'mín', 'máx', 'média', 'desvio')
+
+
+class _Tier:
+    def __init__(self, resolution, label, n_columns):
+        self.resolution = resolution
+        self.label = label
+        self.key = None
+        self.n = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.min = np.full(n_columns, np.inf)
+        self.max = np.full(n_columns, -np.inf)
+        self.timestamps = []
+        self.rows = []
+
+    def merge(self, n, mean, m2, mn, mx):
+        # Combinação de Chan et al. de duas estatísticas parciais (Welford em bloco)
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            ratio = np.where(total > 0, n / total, 0)
+            self.mean = self.mean + delta * ratio
+            self.m2 = self.m2 + m2 + delta ** 2 * self.n * ratio
+        self.n = total
+        self.min = np.minimum(self.min, mn)
+        self.max = np.maximum(self.max, mx)
+
+    def close(self):
+        if self.key is None:
+            return
+        with np.errstate(invalid='ignore', divide='ignore'):
+            valid = self.n > 0
+            row = np.stack([self.n,
+                            np.where(valid, self.min, np.nan),
+                            np.where(valid, self.max, np.nan),
+                            np.where(valid, self.mean, np.nan),
+                            np.where(valid, np.sqrt(self.m2 / self.n), np.nan)], axis=1).ravel()
+        self.timestamps.append(self.key * self.resolution)
+        self.rows.append(row)
+        self.key = None
+        self.n[:] = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+        self.min[:] = np.inf
+        self.max[:] = -np.inf
+
+
+class StreamingAggregator:
+    # Estatísticas por janela (n, mín, máx, média, desvio padrão populacional) de
+    # cada coluna, em várias resoluções, atualizadas a cada lote em O(1) por
+    # amostra e sem guardar as amostras. Uma janela só é fechada quando chega a
+    # primeira amostra da seguinte (ou em close()). NaN (sensor com falha) não entra.
+    def __init__(self, columns, tiers=DEFAULT_TIERS):
+        self.source_columns = list(columns)
+        self.columns = [f'{column} {stat}' for column in self.source_columns for stat in STATS]
+        self.tiers = [_Tier(resolution, label, len(self.source_columns)) for resolution, label in tiers]
+
+    def update(self, timestamps, data):
+        # timestamps em segundos (epoch), crescentes; data (amostras x colunas)
+        timestamps = np.asarray(timestamps, dtype=float)
+        data = np.atleast_2d(np.asarray(data, dtype=float))
+        if len(timestamps) == 0:
+            return
+        finite = ~np.isnan(data)
+        for tier in self.tiers:
+            keys = np.floor(timestamps / tier.resolution).astype(np.int64)
+            bounds = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1, [len(keys)]])
+            for a, b in zip(bounds[:-1], bounds[1:]):
+                if keys[a] != tier.key:
+                    tier.close()
+                    tier.key = keys[a]
+                block = data[a:b]
+                ok = finite[a:b]
+                n = ok.sum(axis=0)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = np.where(n > 0, np.where(ok, block, 0).sum(axis=0) / n, 0)
+                m2 = np.where(ok, (block - mean) ** 2, 0).sum(axis=0)
+                tier.merge(n, mean, m2,
+                           np.where(ok, block, np.inf).min(axis=0),
+                           np.where(ok, block, -np.inf).max(axis=0))
+
+    def close(self):
+        # Fecha as janelas abertas (fim da aquisição ou troca de sensores)
+        for tier in self.tiers:
+            tier.close()
+
+    def drain(self):
+        # Retorna e esquece as janelas já fechadas: [(rótulo, horários, linhas)]
+        out = []
+        for tier in self.tiers:
+            if tier.rows:
+                out.append((tier.label, np.array(tier.timestamps), np.array(tier.rows)))
+                tier.timestamps = []
+                tier.rows = []
+        return out
@@ -0,0 +1,153 @@
+import argparse
+import time
+import logging
+import numpy as np
+from collections import namedtuple
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EVALUATE = metrics.histogram('alarm_evaluate_seconds', 'Avaliação dos alarmes de um lote')
+LATENCY = metrics.histogram('alarm_latency_seconds',
+                            'Da resposta do interrogador até a avaliação dos alarmes (amostra mais antiga do lote)')
+EVENTS = metrics.counter('alarm_events_total', 'Alarmes disparados')
+LATE = metrics.counter('alarm_late_total', 'Lotes avaliados depois do limite de latência')
+
+FORMAT = '%(asctime)s @ %(name)s (%(levelname)s) >> %(message)s'
+
+# timestamp: horário da amostra (epoch); active: True ao disparar, False ao normalizar;
+# latency: segundos entre a resposta do interrogador e a detecção
+AlarmEvent = namedtuple('AlarmEvent', ['timestamp', 'sensor', 'kind', 'active', 'value', 'latency'])
+
+
+class AlarmEngine:
+    # Alarmes de todos os sensores avaliados juntos, amostra a amostra: falha
+    # (lambdaBragg == 0), abaixo do mínimo, acima do máximo e taxa de variação
+    # acima do limite, com os limites da planilha (SensorArray.alarm_*).
+    # Histerese: o alarme de limite só normaliza a `hysteresis` do limite.
+    # Debounce: uma mudança de estado exige `debounce` amostras seguidas.
+    kinds = ('falha', 'mín', 'máx', 'taxa')
+
+    def __init__(self, sensors, debounce=2, latency_budget=None):
+        self.sensors = sensors
+        self.debounce = debounce
+        self.latency_budget = latency_budget
+        n = len(sensors)
+        self.active = np.zeros((len(self.kinds), n), dtype=bool)
+        self.count = np.zeros((len(self.kinds), n), dtype=np.int64)
+        self.last_value = np.full(n, np.nan)
+        self.last_time = np.full(n, np.nan)
+        self.max_latency = 0
+
+    def evaluate(self, timestamps, lambdaBragg, temperature, strain, now=None):
+        # timestamps em segundos (epoch); matrizes (amostras x sensores) como em SensorArray.convert
+        if len(timestamps) == 0:
+            return []
+        t0 = metrics.clock()
+        s = self.sensors
+        timestamps = np.asarray(timestamps, dtype=float)
+        m, n = len(timestamps), len(s)
+        values = np.where(s.is_temp, temperature, strain)
+
+        # Taxa de variação em relação ao último valor válido de cada sensor (o do
+        # lote anterior na primeira linha): índice da última linha finita, acumulado
+        history = np.vstack([self.last_value, values])
+        times = np.vstack([self.last_time, np.broadcast_to(timestamps[:, None], (m, n))])
+        rows = np.where(~np.isnan(history), np.arange(m + 1)[:, None], 0)
+        np.maximum.accumulate(rows, axis=0, out=rows)
+        columns = np.arange(n)
+        previous = rows[:-1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate = np.abs(values - history[previous, columns]) / (timestamps[:, None] - times[previous, columns])
+            # (amostras x tipos x sensores); comparações com NaN (sensor em falha,
+            # limite ausente) não disparam nem normalizam
+            trigger = np.stack([lambdaBragg == 0, values < s.alarm_min, values > s.alarm_max,
+                                rate > s.alarm_rate], axis=1)
+            clear = np.stack([lambdaBragg != 0, values > s.alarm_min + s.hysteresis,
+                              values < s.alarm_max - s.hysteresis, rate <= s.alarm_rate], axis=1)
+        self.last_value = history[rows[-1], columns]
+        self.last_time = times[rows[-1], columns]
+
+        # Só o debounce é sequencial
+        events = []
+        for j in range(m):
+            pending = np.where(self.active, clear[j], trigger[j])
+            self.count = np.where(pending, self.count + 1, 0)
+            flip = self.count >= self.debounce
+            if flip.any():
+                self.active ^= flip
+                self.count[flip] = 0
+                for k, i in zip(*np.nonzero(flip)):
+                    events.append((timestamps[j], s.names[i], self.kinds[k], bool(self.active[k, i]),
+                                   rate[j, i] if k == 3 else values[j, i]))
+
+        # Latência medida da amostra mais antiga do lote, a que mais esperou
+        now = time.time() if now is None else now
+        latency = now - timestamps[0]
+        LATENCY.observe(latency)
+        self.max_latency = max(self.max_latency, latency)
+        if self.latency_budget is not None and latency > self.latency_budget:
+            LATE.inc()
+            logger.warning(f'Alarmes avaliados {latency * 1e3:.0f} ms depois da leitura '
+                           f'(limite {self.latency_budget * 1e3:.0f} ms)')
+        events = [AlarmEvent(*event, now - event[0]) for event in events]
+        EVENTS.inc(sum(event.active for event in events))
+        EVALUATE.observe_since(t0)
+        return events
+
+    def current(self):
+        # [(sensor, tipo)] dos alarmes ativos
+        return [(self.sensors.names[i], self.kinds[k]) for k, i in zip(*np.nonzero(self.active))]
+
+    labels = {'falha': 'falha do sensor', 'mín': 'abaixo do mínimo', 'máx': 'acima do máximo',
+              'taxa': 'taxa de variação'}
+
+    @classmethod
+    def describe(cls, event):
+        text = f'{"ALARME" if event.active else "Normalizado"} {event.sensor} ({cls.labels[event.kind]})'
+        if event.kind == 'taxa':
+            return f'{text}: {event.value:.3g}/s'
+        if event.kind != 'falha':
+            return f'{text}: {event.value:.3f}'
+        return text
+
+    def log(self, events):
+        for event in events:
+            if event.active:
+                logger.warning(f'{self.describe(event)} ({event.latency * 1e3:.0f} ms)')
+            else:
+                logger.info(self.describe(event))
+
+
+def main(argv=None):
+    # Os alarmes também podem rodar num processo à parte, lendo o anel do daemon
+    from sensor_config import SensorConfigCache
+    from shm import RingReader
+    parser = argparse.ArgumentParser(description='Alarmes a partir do anel em memória compartilhada do daemon')
+    parser.add_argument('name', nargs='?', default='braggmeter', help='nome do anel')
+    parser.add_argument('--config', default='sensor_data.xlsx', help='planilha de sensores com os limites')
+    parser.add_argument('--sheet', default='Grade', help='aba da planilha de sensores')
+    parser.add_argument('--debounce', type=int, default=2, help='amostras seguidas para mudar o estado')
+    parser.add_argument('--poll', type=float, default=0.005, help='segundos entre leituras do anel')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=FORMAT, datefmt='%d-%m-%Y %H:%M:%S')
+
+    sensors = SensorConfigCache().get(args.config, args.sheet)
+    engine = AlarmEngine(sensors, debounce=args.debounce)
+    reader = RingReader(args.name)
+    try:
+        while True:
+            time.sleep(args.poll)
+            timestamps, _, ring_lambda = reader.read()
+            if len(timestamps) == 0:
+                continue
+            source = reader.align(sensors.names)
+            lambdaBragg = np.where(source >= 0, ring_lambda[:, source], 0)
+            temperature, _, strain = sensors.convert(lambdaBragg)
+            engine.log(engine.evaluate(timestamps, lambdaBragg, temperature, strain))
+    except KeyboardInterrupt:
+        reader.detach()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import logging
+import numpy as np
+from acquisition import Scheduler, MultiAcquisitionWorker
+from buffer import SampleBuffer
+from emulator import BraggMeterEmulator
+from braggmeter import BraggMeter
+from plotting import minmax_decimate, plot_capacity
+from sensor import SensorArray
+from storage import BACKENDS
+
+logger = logging.getLogger(__name__)
+
+# Benchmark sem interface gráfica da cadeia get_peaks -> conversão -> plot -> gravação,
+# contra o emulador local do BraggMETER.
+
+
+def rss():
+    # Memória residente do processo, em bytes
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(samples):
+    if len(samples) == 0:
+        return {}
+    ms = np.asarray(samples) * 1e3
+    return {'n': len(ms), 'mean_ms': float(ms.mean()), 'p50_ms': float(np.percentile(ms, 50)),
+            'p90_ms': float(np.percentile(ms, 90)), 'p99_ms': float(np.percentile(ms, 99)),
+            'max_ms': float(ms.max())}
+
+
+def make_sensors(n_sensors, n_channels, n_devices=1):
+    # Um sensor de temperatura por canal, o resto de deformação, espaçados em 1510-1590 nm.
+    # Com vários interrogadores, todos repetem o mesmo projeto de grades.
+    per_channel = max(1, n_sensors // n_channels)
+    n = per_channel * n_channels
+    channels = np.repeat(np.arange(n_channels), per_channel)
+    types = np.where(np.arange(n) % per_channel == 0, 'Temperatura', 'Deformação')
+    m = n * n_devices
+    return SensorArray([f'S{i}' for i in range(m)], np.tile(types, n_devices), np.tile(channels, n_devices),
+                       np.tile(np.linspace(1510, 1590, n), n_devices),
+                       s0=np.full(m, 25.), s1=np.full(m, 34.8), s2=np.full(m, -0.8),
+                       k=np.full(m, 0.78), tcs=np.full(m, 7.5), cte=np.zeros(m), T0=np.full(m, 22.),
+                       devices=np.repeat(np.arange(n_devices), n))
+
+
+class Stages:
+    def __init__(self, sensors, directory, flush_rows=240, plot_window=60, plot_fps=20, plot_rate=100,
+                 storage_format='csv'):
+        # plot_rate: amostras/s guardadas para o gráfico; o buffer tem o tamanho
+        # do da interface (LivePlotter) para a mesma janela e taxa
+        self.sensors = sensors
+        self.channels = np.unique(sensors.channels).tolist()
+        self.strain_idx = np.flatnonzero(sensors.is_strain)
+        self.buffer = SampleBuffer(sensors.columns(), flush_rows=flush_rows)
+        capacity = plot_capacity(plot_window, plot_rate, len(self.strain_idx))
+        self.plot_buffer = SampleBuffer(range(len(self.strain_idx)), capacity=capacity, flush_rows=capacity)
+        self.backend = BACKENDS[storage_format](directory)
+        self.plot_window = plot_window
+        self.plot_period = 1 / plot_fps
+        self.last_plot = 0
+        self.times = {name: [] for name in ('acquire', 'convert', 'buffer', 'plot', 'store', 'total')}
+
+    def timed(self, name, fn, *args):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        self.times[name].append(time.perf_counter() - t0)
+        return result
+
+    def convert(self, peaks):
+        _, lambdaBragg = self.sensors.match_batch(peaks)
+        return lambdaBragg, self.sensors.convert(lambdaBragg)
+
+    def append(self, timestamps, lambdaBragg, converted):
+        temperature, mean_temperature, strain = converted
+        self.buffer.extend(timestamps, self.sensors.table(lambdaBragg, temperature, mean_temperature, strain))
+        self.plot_buffer.extend(timestamps, strain[:, self.strain_idx])
+        self.plot_buffer.mark_flushed()
+
+    def plot(self):
+        timestamps, values = self.plot_buffer.last()
+        i = np.searchsorted(timestamps, timestamps[-1] - self.plot_window)
+        return minmax_decimate(timestamps[i:], values[i:], 2000)
+
+    def store(self):
+        timestamps, data = self.buffer.unflushed()
+        self.backend.write('benchmark', self.buffer.columns, timestamps, data)
+        self.buffer.mark_flushed()
+
+    def process(self, bragg_per_ch, timestamp):
+        t0 = time.perf_counter()
+        peaks = [np.sort(np.concatenate([np.asarray(b, dtype=float) for b in bragg_per_ch]))]
+        lambdaBragg, converted = self.timed('convert', self.convert, peaks)
+        self.timed('buffer', self.append, [timestamp], lambdaBragg, converted)
+        if timestamp - self.last_plot >= self.plot_period:
+            self.last_plot = timestamp
+            self.timed('plot', self.plot)
+        if self.buffer.should_flush():
+            self.timed('store', self.store)
+        return time.perf_counter() - t0
+
+
+def run_chain(n_sensors, n_channels, rate, duration, latency=0.0):
+    sensors = make_sensors(n_sensors, n_channels)
+    emulator = BraggMeterEmulator(channels=n_channels, sensors_per_channel=0, latency=latency).start()
+    emulator.set_sensors(sensors.lambdaBragg_0, sensors.channels)
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            meter = BraggMeter('127.0.0.1', emulator.port)
+            meter.start()
+            # Sem limite de taxa, o gráfico guarda o mesmo que a interface na taxa máxima dela
+            stages = Stages(sensors, directory, plot_rate=rate or 100)
+            scheduler = Scheduler(1 / rate) if rate else None
+            rss_start = rss()
+            t_start = time.perf_counter()
+            count = 0
+            while time.perf_counter() - t_start < duration:
+                t0 = time.perf_counter()
+                bragg_per_ch = stages.timed('acquire', meter.get_all_peaks, stages.channels)
+                stages.process(bragg_per_ch, time.time())
+                stages.times['total'].append(time.perf_counter() - t0)
+                count += 1
+                if scheduler is not None:
+                    delay, _ = scheduler.next_delay()
+                    time.sleep(delay)
+            elapsed = time.perf_counter() - t_start
+            meter.close()
+        finally:
+            emulator.stop()
+        stages.backend.close()
+        return {'mode': 'chain', 'sensors': len(sensors), 'channels': n_channels, 'rate_hz': rate,
+                'latency_s': latency, 'samples': count, 'throughput_hz': count / elapsed,
+                'missed_ticks': scheduler.missed if scheduler is not None else None,
+                'rss_growth_bytes': rss() - rss_start,
+                'stages': {name: percentiles(t) for name, t in stages.times.items()}}
+
+
+def run_devices(n_sensors, n_channels, n_devices, duration, latency=0.0, interval=0.01):
+    # Vazão com vários interrogadores: leitura em série (uma ida e volta depois da outra)
+    # contra um worker por interrogador com alinhamento no tempo
+    sensors = make_sensors(n_sensors, n_channels, n_devices)
+    channels = sensors.acquisition_channels()
+    emulators = []
+    meters = []
+    try:
+        for device in range(n_devices):
+            emulator = BraggMeterEmulator(channels=n_channels, sensors_per_channel=0, latency=latency).start()
+            mine = sensors.devices == device
+            emulator.set_sensors(sensors.lambdaBragg_0[mine], sensors.channels[mine])
+            emulators.append(emulator)
+            meters.append(BraggMeter('127.0.0.1', emulator.port))
+            meters[-1].start()
+        if n_devices == 1:
+            channels = [channels]
+
+        t_start = time.perf_counter()
+        serial = 0
+        while time.perf_counter() - t_start < duration:
+            sensors.match_samples([[meter.get_all_peaks(ch) for meter, ch in zip(meters, channels)]]
+                                  if n_devices > 1 else [meters[0].get_all_peaks(channels[0])])
+            serial += 1
+        serial_hz = serial / (time.perf_counter() - t_start)
+
+        logging.getLogger('acquisition').setLevel(logging.ERROR)     # ticks perdidos são esperados aqui
+        reads = [lambda meter=meter, ch=ch: meter.get_all_peaks(ch) for meter, ch in zip(meters, channels)]
+        worker = MultiAcquisitionWorker(reads, interval)
+        worker.start()
+        t_start = time.perf_counter()
+        aligned = 0
+        while time.perf_counter() - t_start < duration:
+            batch = worker.wait_batch(timeout=0.1)
+            if batch:
+                data = [sample.data for sample in batch]
+                sensors.match_samples(data if n_devices > 1 else [d[0] for d in data])
+                aligned += len(batch)
+        concurrent_hz = aligned / (time.perf_counter() - t_start)
+        worker.stop(timeout=1)
+        partial = worker.partial
+        for meter in meters:
+            meter.close()
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+    return {'mode': 'devices', 'sensors': len(sensors), 'channels': n_channels, 'devices': n_devices,
+            'latency_s': latency, 'interval_s': interval, 'serial_hz': serial_hz,
+            'throughput_hz': concurrent_hz, 'partial_samples': partial, 'stages': {}}
+
+
+def run_stages(n_sensors, n_channels, repeat, batch=1, storage_format='csv'):
+    # Cada estágio isolado, com entradas sintéticas, sem rede
+    sensors = make_sensors(n_sensors, n_channels)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        stages = Stages(sensors, directory, storage_format=storage_format)
+        rss_start = rss()
+        now = time.time()
+        for k in range(repeat):
+            peaks = [np.sort(sensors.lambdaBragg_0 + rng.normal(0, 0.01, len(sensors))) for _ in range(batch)]
+            timestamps = now + (k * batch + np.arange(batch)) * 1e-3
+            lambdaBragg, converted = stages.timed('convert', stages.convert, peaks)
+            stages.timed('buffer', stages.append, timestamps, lambdaBragg, converted)
+            stages.timed('plot', stages.plot)
+            if stages.buffer.should_flush():
+                stages.timed('store', stages.store)
+        stages.backend.close()
+        written = sum(os.path.getsize(path) for path in stages.backend.list_files())
+    return {'mode': 'stages', 'sensors': len(sensors), 'channels': n_channels, 'batch': batch,
+            'repeat': repeat, 'rss_growth_bytes': rss() - rss_start, 'format': storage_format,
+            'bytes_per_row': written / max(1, repeat * batch - stages.buffer.pending),
+            'stages': {name: percentiles(t) for name, t in stages.times.items() if t}}
+
+
+def report(result):
+    head = f"{result['mode']:6s} sensores={result['sensors']:5d} canais={result['channels']}"
+    if result['mode'] == 'chain':
+        head += f" taxa={result['rate_hz'] or 'máx'} -> {result['throughput_hz']:.1f} amostras/s"
+    elif result['mode'] == 'devices':
+        head += (f" interrogadores={result['devices']} em série {result['serial_hz']:.1f}/s,"
+                 f" em paralelo {result['throughput_hz']:.1f}/s ({result['partial_samples']} parciais)")
+    if result.get('bytes_per_row'):
+        head += f" {result['format']} {result['bytes_per_row']:.1f} bytes/linha"
+    print(head)
+    for name, stats in result['stages'].items():
+        if stats:
+            print(f"    {name:8s} p50={stats['p50_ms']:8.3f} ms  p99={stats['p99_ms']:8.3f} ms  "
+                  f"max={stats['max_ms']:8.3f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark da cadeia de aquisição contra o emulador')
+    parser.add_argument('--sensors', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--rates', type=float, nargs='+', default=[0],
+                        help='taxas de amostragem em Hz; 0 roda o mais rápido possível')
+    parser.add_argument('--duration', type=float, default=5, help='segundos por cenário')
+    parser.add_argument('--latency', type=float, default=0.0, help='latência simulada por resposta')
+    parser.add_argument('--devices', type=int, nargs='+', default=[],
+                        help='número de interrogadores para comparar leitura em série e em paralelo')
+    parser.add_argument('--repeat', type=int, default=2000, help='repetições por estágio isolado')
+    parser.add_argument('--format', choices=sorted(BACKENDS), default='csv', help='formato de gravação')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = []
+    for n_channels in args.channels:
+        for n_sensors in args.sensors:
+            results.append(run_stages(n_sensors, n_channels, args.repeat, storage_format=args.format))
+            report(results[-1])
+            for rate in args.rates:
+                results.append(run_chain(n_sensors, n_channels, rate, args.duration, args.latency))
+                report(results[-1])
+            for n_devices in args.devices:
+                results.append(run_devices(n_sensors, n_channels, n_devices, args.duration, args.latency))
+                report(results[-1])
+
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__,
+                   'machine': platform.machine(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': results}, f, indent=2)
+    print(f'Resultados em {args.output}')
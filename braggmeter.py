@@ -0,0 +1,294 @@
+import numpy as np
+import socket
+import functools
+import time
+import threading
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RTT = metrics.histogram('braggmeter_rtt_seconds', 'Ida e volta de um lote de comandos ao BraggMETER')
+PARSE = metrics.histogram('braggmeter_parse_seconds', 'Interpretação das respostas (picos e espectros)')
+RECONNECTS = metrics.counter('braggmeter_reconnects_total', 'Sessões refeitas após falha')
+
+@functools.lru_cache(maxsize=8)
+def wavelength_axis(n):
+    wl = np.linspace(1500, 1600, n)
+    wl.flags.writeable = False
+    return wl
+
+
+class BraggMeter:
+    def __init__(self, host='10.0.0.150', port=3500, keepalive=30, binary_trace_command=None):
+        self.commands = {'status': ":STAT?\r\n".encode('ascii'),
+                         'start': ":ACQU:STAR\r\n".encode('ascii'),
+                         'stop': ":ACQU:STOP\r\n".encode('ascii'),
+                         'trace0': ":ACQU:OSAT:CHAN:0?\r\n".encode('ascii'),
+                         'trace1': ":ACQU:OSAT:CHAN:1?\r\n".encode('ascii'),
+                         'trace2': ":ACQU:OSAT:CHAN:2?\r\n".encode('ascii'),
+                         'trace3': ":ACQU:OSAT:CHAN:3?\r\n".encode('ascii'),
+                         'bragg0': ":ACQU:WAVE:CHAN:0?\r\n".encode('ascii'),
+                         'bragg1': ":ACQU:WAVE:CHAN:1?\r\n".encode('ascii'),
+                         'bragg2': ":ACQU:WAVE:CHAN:2?\r\n".encode('ascii'),
+                         'bragg3': ":ACQU:WAVE:CHAN:3?\r\n".encode('ascii'),
+                         }
+        self.host = host
+        self.port = port
+        self.timeout = 10
+        self.keepalive = keepalive      # segundos sem tráfego antes de testar a conexão
+        # Comando do espectro em binário (float32 little-endian), ex.
+        # ':ACQU:OSAT:CHAN:{channel}:BIN?' no emulador; None (padrão) usa só ASCII.
+        # Na primeira leitura o binário é conferido contra o ASCII (número de
+        # pontos) e, se não bater, o equipamento fica no ASCII.
+        self.binary_trace_command = binary_trace_command
+        self.binary_trace_checked = False
+        self.sock = None
+        self.rbuf = bytearray()
+        self.last_activity = 0
+        self.lock = threading.RLock()
+        self.connect()
+
+        status = self.get_status()
+        logger.info(f"BraggMeter status: {status}")
+        if status == 5:
+            err_msg = 'BraggMETER em aquecimento'
+            logger.error(err_msg)
+            raise RuntimeError(err_msg)
+
+    def connect(self):
+        with self.lock:
+            self.close()
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.rbuf = bytearray()
+            self.last_activity = time.monotonic()
+            logger.info(f'Conectado ao BraggMETER em {self.host}:{self.port}')
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                try:
+                    self.sock.close()
+                except OSError:
+                    pass
+                self.sock = None
+
+    def check_connection(self):
+        # NOTE o próprio :STAT? serve de health check da sessão
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.connect()
+                self._exchange([self.commands['status']])
+                return True
+            except (OSError, EOFError) as e:
+                logger.warning(f'Conexão com o BraggMETER perdida: {e}')
+                self.close()
+                return False
+
+    def _ensure_connection(self, retry=True):
+        # Sem retry (tick de aquisição) não reconecta aqui: a falha sobe e quem
+        # refaz a sessão é recover(), fora do tick e com backoff
+        if self.sock is None:
+            if not retry:
+                raise ConnectionError('Sem sessão com o BraggMETER')
+            self.connect()
+        elif retry and time.monotonic() - self.last_activity > self.keepalive:
+            if not self.check_connection():
+                self.connect()
+
+    def _recv(self):
+        chunk = self.sock.recv(1 << 16)
+        if not chunk:
+            raise EOFError('Conexão fechada pelo BraggMETER')
+        self.rbuf += chunk
+
+    def _read_until(self, token):
+        start = 0
+        while True:
+            i = self.rbuf.find(token, start)
+            if i >= 0:
+                resp = bytes(self.rbuf[:i + len(token)])
+                del self.rbuf[:i + len(token)]
+                return resp
+            start = max(0, len(self.rbuf) - len(token) + 1)
+            self._recv()
+
+    def _read_exact(self, n):
+        while len(self.rbuf) < n:
+            self._recv()
+        resp = bytes(self.rbuf[:n])
+        del self.rbuf[:n]
+        return resp
+
+    def _read_reply(self):
+        resp = self._read_until(b'\n')
+        # Bloco binário IEEE 488.2 (#<n><tamanho><dados>): os dados podem conter \n,
+        # então o tamanho do cabeçalho decide quanto ainda falta ler
+        if resp.lstrip().startswith(b':ACK:#'):
+            i = resp.find(b':ACK:#') + 6
+            n = int(resp[i:i + 1])
+            total = i + 1 + n + int(resp[i + 1:i + 1 + n]) + 2
+            if len(resp) < total:
+                resp += self._read_exact(total - len(resp))
+        return resp
+
+    def _exchange(self, strings):
+        # Envia todos os comandos de uma vez e só então lê as respostas (pipelining)
+        t0 = metrics.clock()
+        try:
+            self.sock.sendall(b''.join(strings))
+            resps = []
+            for string in strings:
+                resp = self._read_reply()
+                logger.debug(f'{string} response: {resp[:80]}')
+                resps.append(resp)
+        except (OSError, EOFError):
+            # Resposta incompleta: a sessão fica dessincronizada, então é descartada
+            self.close()
+            raise
+        self.last_activity = time.monotonic()
+        RTT.observe_since(t0)
+        return resps
+
+    def ask(self, key, retry=True):
+        string = self.commands[key]
+        resp = self.send(string, retry=retry)
+        return resp
+
+    def ask_many(self, keys, retry=True):
+        return self.send_many([self.commands[key] for key in keys], retry=retry)
+
+    def send(self, string, raw=False, retry=True):
+        return self.send_many([string], raw=raw, retry=retry)[0]
+
+    def send_many(self, strings, raw=False, retry=True):
+        # retry: reconecta e repete uma vez se a sessão cair (uso interativo).
+        # A aquisição passa retry=False: o socket é fechado e a falha sobe.
+        with self.lock:
+            self._ensure_connection(retry)
+            try:
+                resps = self._exchange(strings)
+            except (OSError, EOFError) as e:
+                if not retry:
+                    raise
+                logger.warning(f'Falha na sessão com o BraggMETER, reconectando: {e}')
+                RECONNECTS.inc()
+                self.connect()
+                resps = self._exchange(strings)
+        if raw:
+            return resps
+        return [resp.decode() for resp in resps]
+
+    def start(self):
+        status = self.get_status()
+        logger.info(f'BraggMETER status: {status}')
+        if status == 1:
+            self.ask('start')
+        elif status == 3 or status == 4:
+            self.ask('stop')
+            self.ask('start')
+        elif status == 5:
+            err_msg = 'BraggMETER em aquecimento'
+            logger.error(err_msg)
+            raise RuntimeError(err_msg)
+
+    def recover(self):
+        # Refaz a sessão e reinicia a aquisição; chamado fora do tick de aquisição
+        self.connect()
+        self.start()
+
+    def stop(self):
+        resp = self.ask('stop')
+        status = self.get_status()
+        logger.info(f'BraggMETER status: {status}')
+        return resp
+
+    def get_status(self):
+        resp = self.ask('status')
+        logger.debug(f'Resposta do status: {resp}')
+        resp = resp.split(':')
+        loc = 0
+        for i in range(0, len(resp)):
+            if resp[i] == 'ACK':
+                loc = i + 1
+        return int(resp[loc])
+
+    def get_osa_trace(self, channel):
+        trace = None
+        if self.binary_trace_command is not None:
+            cmd = f'{self.binary_trace_command.format(channel=channel)}\r\n'.encode('ascii')
+            try:
+                trace = self.parse_trace(self.send(cmd, raw=True, retry=False))
+            except socket.timeout:
+                # Comando ignorado pelo equipamento: não insiste no binário
+                logger.warning('BraggMETER não respondeu ao espectro em binário, usando ASCII')
+                self.binary_trace_command = None
+                raise
+            except ValueError as e:
+                logger.warning(f'Falha ao ler o espectro em binário: {e}')
+            if trace is not None and not self.binary_trace_checked:
+                # Só fica no binário se ele trouxer tantos pontos quanto o ASCII
+                ascii_trace = self.parse_trace(self.send(self.commands[f'trace{channel}'], raw=True, retry=False))
+                if ascii_trace is None or len(trace) < 2 or len(trace) != len(ascii_trace) or \
+                        not np.isfinite(trace).all():
+                    logger.warning(f'Espectro binário ({len(trace)} pontos) não confere com o ASCII')
+                    trace = None
+                else:
+                    self.binary_trace_checked = True
+            if trace is None:
+                logger.info('BraggMETER não enviou o espectro em binário, usando ASCII')
+                self.binary_trace_command = None
+        if trace is None:
+            resp = self.send(self.commands[f'trace{channel}'], raw=True, retry=False)
+            with PARSE.time():
+                trace = self.parse_trace(resp)
+            if trace is None:
+                raise ValueError(f'BraggMETER recusou o espectro do canal {channel}: {resp[:80]}')
+
+        out = np.empty((len(trace), 2))
+        out[:, 0] = wavelength_axis(len(trace))
+        out[:, 1] = trace
+        return out
+
+    @staticmethod
+    def parse_trace(resp):
+        # resp em bytes; retorna None se a resposta não for um :ACK: (ex. :NACK:1)
+        resp = resp.lstrip()
+        if not resp.startswith(b':ACK:'):
+            return None
+        payload = memoryview(resp)[5:]
+        if payload[:1] == b'#':
+            n = int(payload[1:2].tobytes())
+            length = int(payload[2:2 + n].tobytes())
+            if length % 4 or len(payload) < 2 + n + length:
+                raise ValueError(f'Bloco binário inválido: {length} bytes declarados, {len(payload) - 2 - n} recebidos')
+            return np.frombuffer(payload, dtype='<f4', count=length // 4, offset=2 + n).astype(float)
+        # Texto: converte direto dos bytes, sem criar uma string por valor
+        return np.fromstring(resp[5:].rstrip(), dtype=float, sep=',')
+
+    def get_peaks(self, channel):
+        # Uma falha aqui sobe para quem chamou, sem reconectar: a recuperação
+        # (recover) não roda dentro do tick, ver AcquisitionWorker
+        lambdas = self.ask(f'bragg{channel}', retry=False)
+        with PARSE.time():
+            return self.parse_peaks(lambdas)
+
+    def get_all_peaks(self, channels):
+        # Uma única ida e volta para todos os canais
+        resps = self.ask_many([f'bragg{channel}' for channel in channels], retry=False)
+        t0 = metrics.clock()
+        peaks = [self.parse_peaks(resp) for resp in resps]
+        PARSE.observe_since(t0)
+        return peaks
+
+    @staticmethod
+    def parse_peaks(lambdas):
+        i = lambdas.find('ACK') + 4
+        lambdas = lambdas[i:-2].split(',')
+        if len(lambdas) == 0:
+            return []
+        if lambdas[0] == '':
+            return []
+        return [float(lamb) if lamb else 0 for lamb in lambdas]
@@ -0,0 +1,79 @@
+import datetime
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SampleBuffer:
+    # Buffer circular pré-alocado, uma coluna NumPy por canal de medição.
+    # Cada linha é escrita duas vezes (em i e em i + capacity), assim as últimas
+    # n linhas são sempre uma fatia contígua e podem ser lidas sem cópia.
+    def __init__(self, columns, capacity=4096, flush_rows=240, flush_interval=None):
+        if flush_rows > capacity:
+            raise ValueError('flush_rows não pode ser maior que a capacidade do buffer')
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval      # segundos, None desativa
+
+        self.timestamps = np.zeros(2 * capacity)
+        self.data = np.full((2 * capacity, len(self.columns)), np.nan)
+        self.head = 0
+        self.count = 0
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, values):
+        i = self.head
+        self.timestamps[i] = self.timestamps[i + self.capacity] = timestamp
+        self.data[i] = self.data[i + self.capacity] = values
+        self.head = (i + 1) % self.capacity
+        self._advance(1)
+
+    def extend(self, timestamps, values):
+        timestamps = np.asarray(timestamps, dtype=float)[-self.capacity:]
+        values = np.asarray(values, dtype=float)[-self.capacity:]
+        k = len(timestamps)
+        idx = (self.head + np.arange(k)) % self.capacity
+        self.timestamps[idx] = self.timestamps[idx + self.capacity] = timestamps
+        self.data[idx] = self.data[idx + self.capacity] = values
+        self.head = (self.head + k) % self.capacity
+        self._advance(k)
+
+    def _advance(self, k):
+        self.count = min(self.count + k, self.capacity)
+        self.pending += k
+        if self.pending > self.capacity:
+            logger.warning(f'{self.pending - self.capacity} amostras sobrescritas antes de serem salvas')
+            self.pending = self.capacity
+
+    def last(self, n=None):
+        # Visões (sem cópia) das últimas n linhas; só valem até o próximo append
+        n = self.count if n is None else min(n, self.count)
+        end = self.head + self.capacity
+        return self.timestamps[end - n:end], self.data[end - n:end]
+
+    def unflushed(self):
+        return self.last(self.pending)
+
+    def should_flush(self):
+        if self.pending >= self.flush_rows:
+            return True
+        return self.flush_interval is not None and self.pending > 0 and \
+            time.monotonic() - self.last_flush >= self.flush_interval
+
+    def mark_flushed(self):
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def to_frame(self, n=None, time_column='Horário'):
+        import pandas as pd
+        timestamps, data = self.last(n)
+        df = pd.DataFrame(data.copy(), columns=self.columns)
+        df.insert(0, time_column, [datetime.datetime.fromtimestamp(t) for t in timestamps])
+        return df
@@ -0,0 +1,218 @@
+import argparse
+import datetime
+import json
+import os
+import struct
+import sys
+import zlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Arquivo: MAGIC, tamanho e JSON do cabeçalho (colunas, passos) e blocos
+# independentes, cada um com BLOCK (linhas, bytes comprimidos, crc32) + zlib
+MAGIC = b'BRGC\x01'
+EXTENSION = '.brg'
+BLOCK = struct.Struct('<III')
+WIDTHS = (np.int8, np.int16, np.int32, np.int64)
+# Passo do ponto fixo pela unidade no início do nome da coluna. O comprimento de
+# onda fica no passo do interrogador (1 fm, sem perda); temperatura e deformação,
+# que variam ~0,1 °C e ~1 ue por pm, ficam bem abaixo da precisão do sensor.
+RESOLUTIONS = {'Bragg (nm)': 1e-6, 'Temperatura (°C)': 1e-4, 'Strain (ue)': 1e-3}
+DEFAULT_RESOLUTION = 1e-6
+
+
+def resolution(column):
+    for prefix, value in RESOLUTIONS.items():
+        if column.startswith(prefix):
+            return value
+    return DEFAULT_RESOLUTION
+
+
+def _pack_ints(values):
+    # Inteiros com sinal no menor tipo que os comporta: código do tipo + bytes
+    # agrupados por posição (todos os primeiros bytes, depois os segundos...),
+    # o que deixa os bytes altos, quase sempre 0 ou 255, em sequência para o zlib
+    if len(values) == 0:
+        return b'\x00'
+    lo, hi = values.min(), values.max()
+    for code, dtype in enumerate(WIDTHS):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            planes = values.astype(dtype).view(np.uint8).reshape(-1, np.dtype(dtype).itemsize).T
+            return bytes([code]) + planes.tobytes()
+
+
+def _unpack_ints(buf, pos, count):
+    dtype = np.dtype(WIDTHS[buf[pos]])
+    size = dtype.itemsize * count
+    planes = np.frombuffer(buf, dtype=np.uint8, count=size, offset=pos + 1).reshape(dtype.itemsize, count)
+    return np.ascontiguousarray(planes.T).view(dtype).ravel().astype(np.int64), pos + 1 + size
+
+
+def encode_block(timestamps, data, resolutions, level=3):
+    # timestamps em segundos (epoch) -> microssegundos em delta-de-delta; cada
+    # coluna em ponto fixo (múltiplos de resolutions[c]) como primeiro valor + diferenças.
+    # NaN vira uma máscara de bits e repete o valor anterior, para não quebrar as diferenças.
+    timestamps = np.asarray(timestamps, dtype=float)
+    data = np.atleast_2d(np.asarray(data, dtype=float))
+    n, n_columns = data.shape
+    micro = np.round(timestamps * 1e6).astype(np.int64)
+    delta = np.diff(micro)
+    parts = [struct.pack('<qq', micro[0], delta[0] if n > 1 else 0), _pack_ints(np.diff(delta))]
+
+    valid = np.isfinite(data)
+    rows = np.where(valid, np.arange(n)[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    filled = np.nan_to_num(data[rows, np.arange(n_columns)], nan=0, posinf=0, neginf=0)
+    fixed = np.round(filled / np.asarray(resolutions, dtype=float)).astype(np.int64)
+    # Todas as colunas numa matriz só: o decodificador desfaz tudo com um cumsum
+    if valid.all():
+        parts.append(b'\x00')
+    else:
+        parts.append(b'\x01' + np.packbits(valid).tobytes())
+    parts.append(fixed[0].tobytes())
+    parts.append(_pack_ints(np.diff(fixed, axis=0).T.ravel()))
+    payload = zlib.compress(b''.join(parts), level)
+    return BLOCK.pack(n, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_block(payload, n, resolutions):
+    buf = zlib.decompress(payload)
+    t0, d0 = struct.unpack_from('<qq', buf, 0)
+    dd, pos = _unpack_ints(buf, 16, max(n - 2, 0))
+    micro = np.empty(n, dtype=np.int64)
+    micro[0] = t0
+    if n > 1:
+        micro[1] = d0
+        micro[2:] = dd
+        np.cumsum(np.cumsum(micro[1:]), out=micro[1:])
+        micro[1:] += t0
+    n_columns = len(resolutions)
+    valid = None
+    if buf[pos]:
+        size = (n * n_columns + 7) // 8
+        valid = np.unpackbits(np.frombuffer(buf, dtype=np.uint8, count=size, offset=pos + 1),
+                              count=n * n_columns).reshape(n, n_columns).astype(bool)
+        pos += size
+    pos += 1
+    fixed = np.empty((n, n_columns), dtype=np.int64)
+    fixed[0] = np.frombuffer(buf, dtype=np.int64, count=n_columns, offset=pos)
+    steps, pos = _unpack_ints(buf, pos + 8 * n_columns, (n - 1) * n_columns)
+    fixed[1:] = steps.reshape(n_columns, n - 1).T
+    np.cumsum(fixed, axis=0, out=fixed)
+    data = fixed * np.asarray(resolutions, dtype=float)
+    if valid is not None:
+        data[~valid] = np.nan
+    return micro / 1e6, data
+
+
+def header(columns, resolutions, time_column='Horário'):
+    meta = json.dumps({'columns': list(columns), 'time_column': time_column, 'resolutions': list(resolutions)},
+                      ensure_ascii=False).encode()
+    return MAGIC + struct.pack('<I', len(meta)) + meta
+
+
+def read_header(f):
+    # -> (metadados, posição do primeiro bloco)
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{getattr(f, "name", f)} não é um arquivo de medições binário')
+    size, = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(size)), len(MAGIC) + 4 + size
+
+
+def iter_blocks(path, offset=0):
+    # Percorre os blocos completos a partir de offset (0: o primeiro), devolvendo
+    # (fim do bloco, horários, dados). Um bloco final incompleto (gravação
+    # interrompida) é ignorado; o próximo leitor o encontra completo.
+    with open(path, 'rb') as f:
+        meta, start = read_header(f)
+        f.seek(max(offset, start))
+        while True:
+            position = f.tell()
+            head = f.read(BLOCK.size)
+            if len(head) < BLOCK.size:
+                return
+            n, size, crc = BLOCK.unpack(head)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            if zlib.crc32(payload) != crc:
+                logger.error(f'Bloco corrompido em {path} (byte {position}), leitura interrompida')
+                return
+            timestamps, data = decode_block(payload, n, meta['resolutions'])
+            yield f.tell(), timestamps, data
+
+
+def block_ranges(path, chunk_bytes=None):
+    # Só lê os cabeçalhos: (metadados, [(início, fim)]) dos blocos completos,
+    # juntando blocos vizinhos em faixas de até chunk_bytes
+    ranges = []
+    with open(path, 'rb') as f:
+        meta, position = read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        while position + BLOCK.size <= size:
+            f.seek(position)
+            _, length, _ = BLOCK.unpack(f.read(BLOCK.size))
+            end = position + BLOCK.size + length
+            if end > size:
+                break
+            if ranges and chunk_bytes and end - ranges[-1][0] <= chunk_bytes:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((position, end))
+            position = end
+    return meta, ranges
+
+
+def decode_blocks(raw, resolutions):
+    # Blocos completos e consecutivos (uma faixa de block_ranges) -> (horários, dados)
+    times, values = [], []
+    position = 0
+    while position < len(raw):
+        n, length, _ = BLOCK.unpack_from(raw, position)
+        position += BLOCK.size
+        timestamps, data = decode_block(raw[position:position + length], n, resolutions)
+        times.append(timestamps)
+        values.append(data)
+        position += length
+    if not times:
+        return np.empty(0), np.empty((0, len(resolutions)))
+    return np.concatenate(times), np.concatenate(values)
+
+
+def read_file(path):
+    # -> (colunas, horários, dados) do arquivo inteiro
+    with open(path, 'rb') as f:
+        meta, _ = read_header(f)
+    blocks = [(timestamps, data) for _, timestamps, data in iter_blocks(path)]
+    if not blocks:
+        return meta['columns'], np.empty(0), np.empty((0, len(meta['columns'])))
+    return meta['columns'], np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks])
+
+
+def read_dataframe(path):
+    # Mesmo formato do pd.read_csv(..., parse_dates=[coluna de horário]) de um CSV gravado
+    import pandas as pd
+    with open(path, 'rb') as f:
+        meta, _ = read_header(f)
+    columns, timestamps, data = read_file(path)
+    df = pd.DataFrame(data, columns=columns)
+    # Horário local sem fuso, como no CSV
+    stamps = [datetime.datetime.fromtimestamp(t) for t in timestamps]
+    df.insert(0, meta['time_column'], pd.to_datetime(stamps))
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converte um arquivo de medições binário (.brg) em CSV')
+    parser.add_argument('path', help='arquivo .brg')
+    parser.add_argument('output', nargs='?', default=None, help='CSV de saída (padrão: saída padrão)')
+    args = parser.parse_args(argv)
+    df = read_dataframe(args.path)
+    df.to_csv(args.output or sys.stdout, index=False, float_format='%.10g')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+import argparse
+import datetime
+import json
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+import logging
+import functools
+from acquisition import AcquisitionWorker, MultiAcquisitionWorker, Sample, Scheduler
+from braggmeter import BraggMeter
+from buffer import SampleBuffer
+from aggregates import StreamingAggregator
+from sensor_config import SensorConfigCache
+from storage import StorageWriter, BACKENDS
+from shm import SampleRing
+from alarms import AlarmEngine
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONVERT = metrics.histogram('convert_seconds', 'Casamento dos picos e conversão de um lote')
+
+FORMAT = '%(asctime)s @ %(name)s (%(levelname)s) >> %(message)s'
+
+
+class AcquisitionCore:
+    # Aquisição, calibração e gravação sem Qt: o worker lê o interrogador e esta
+    # classe converte os lotes numa thread própria, grava e repassa aos assinantes.
+    # meter pode ser uma lista, um interrogador por entrada de sensors.device_list().
+    def __init__(self, meter, sensors, interval=1, storage=None, stream='medições',
+                 flush_rows=240, flush_interval=600, tolerance=None, policy='skip', raw=True,
+                 alarm_debounce=2, alarm_latency_budget=0.2):
+        self.meters = list(meter) if isinstance(meter, (list, tuple)) else [meter]
+        self.meter = self.meters[0]
+        self.sensors = sensors
+        self.channels = sensors.acquisition_channels()
+        self.storage = storage
+        self.stream = stream
+        self.buffer = SampleBuffer(sensors.columns(), flush_rows=flush_rows, flush_interval=flush_interval)
+        # Agregados de 1 s, 1 min e 1 h vão para os fluxos <stream>_1s etc.; raw=False grava só eles
+        self.aggregator = StreamingAggregator(self.buffer.columns)
+        self.raw = raw
+        self.alarms = AlarmEngine(sensors, debounce=alarm_debounce, latency_budget=alarm_latency_budget)
+        self.alarm_subscribers = []
+        self.subscribers = []
+        n_devices = len(sensors.device_list())
+        if len(self.meters) != n_devices:
+            raise ValueError(f'{len(self.meters)} interrogador(es) para {n_devices} na configuração de sensores')
+        if n_devices > 1:
+            self.worker = MultiAcquisitionWorker([functools.partial(self.read, d) for d in range(n_devices)],
+                                                 interval, tolerance=tolerance, policy=policy,
+                                                 recovers=[meter.recover for meter in self.meters])
+        else:
+            self.worker = AcquisitionWorker(self.read, interval, policy=policy, recover=self.meter.recover)
+        self._stop = threading.Event()
+        self.thread = None
+
+    def read(self, device=None):
+        if device is None:
+            return self.meter.get_all_peaks(self.channels)
+        return self.meters[device].get_all_peaks(self.channels[device])
+
+    def subscribe(self, callback):
+        # callback(batch, lambdaBragg, (temperatura, temperatura média, deformação))
+        self.subscribers.append(callback)
+
+    def subscribe_alarms(self, callback):
+        # callback([AlarmEvent]), chamado antes da gravação e dos outros assinantes
+        self.alarm_subscribers.append(callback)
+
+    def start(self):
+        for meter in self.meters:
+            meter.start()
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, name='processing', daemon=True)
+        self.thread.start()
+        self.worker.start()
+
+    def stop(self):
+        self.worker.stop(timeout=self.meter.timeout)
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.aggregator.close()
+        self.flush()
+        for meter in self.meters:
+            try:
+                meter.stop()
+            except Exception as e:
+                logger.error(f'Erro ao parar o BraggMETER: {e}')
+            meter.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self.worker.wait_batch(timeout=0.5)
+            if batch:
+                self.process(batch)
+        self.process(self.worker.get_batch())
+
+    def process(self, batch):
+        if len(batch) == 0:
+            return
+        t0 = metrics.clock()
+        lambdaBragg = self.sensors.match_samples([sample.data for sample in batch])
+        converted = self.sensors.convert(lambdaBragg)
+        CONVERT.observe_since(t0)
+        timestamps = [sample.timestamp.timestamp() for sample in batch]
+        events = self.alarms.evaluate(timestamps, lambdaBragg, converted[0], converted[2])
+        if events:
+            self.alarms.log(events)
+            for callback in self.alarm_subscribers:
+                try:
+                    callback(events)
+                except Exception as e:
+                    logger.error(f'Erro num assinante de alarmes: {e}')
+        rows = self.sensors.table(lambdaBragg, *converted)
+        self.buffer.extend(timestamps, rows)
+        self.aggregator.update(timestamps, rows)
+        if self.buffer.should_flush():
+            self.flush()
+        for callback in self.subscribers:
+            try:
+                callback(batch, lambdaBragg, converted)
+            except Exception as e:
+                logger.error(f'Erro num assinante da aquisição: {e}')
+
+    def flush(self):
+        tiers = self.aggregator.drain()
+        if self.storage is not None:
+            if self.raw and self.buffer.pending > 0:
+                timestamps, data = self.buffer.unflushed()
+                self.storage.submit(self.stream, self.buffer.columns, timestamps, data)
+            for label, timestamps, rows in tiers:
+                self.storage.submit(f'{self.stream}_{label}', self.aggregator.columns, timestamps, rows)
+        self.buffer.mark_flushed()
+
+
+class StreamServer:
+    # Publica as amostras brutas (horário e picos por canal) em JSON, uma por linha,
+    # para clientes como a interface gráfica. Clientes lentos perdem amostras,
+    # nunca atrasam a aquisição.
+    def __init__(self, host='127.0.0.1', port=3600, client_queue=1024):
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                q = queue.Queue(maxsize=client_queue)
+                client = (q, self.request)
+                with server.lock:
+                    server.clients.append(client)
+                logger.info(f'Cliente conectado ao stream: {self.client_address}')
+                try:
+                    while True:
+                        line = q.get()
+                        if line is None:
+                            break
+                        self.request.sendall(line)
+                except OSError:
+                    pass
+                finally:
+                    with server.lock:
+                        server.clients.remove(client)
+                    logger.info(f'Cliente desconectado do stream: {self.client_address}')
+
+        self.lock = threading.Lock()
+        self.clients = []
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stream', daemon=True)
+        self.thread.start()
+
+    def publish(self, batch, *args):
+        lines = b''.join(json.dumps({'t': sample.timestamp.timestamp(), 'peaks': sample.data}).encode() + b'\n'
+                         for sample in batch)
+        with self.lock:
+            clients = list(self.clients)
+        for q, _ in clients:
+            try:
+                q.put_nowait(lines)
+            except queue.Full:
+                pass
+
+    def close(self):
+        # Sem a trava (o handler precisa dela para sair) e sem bloquear: esvazia a
+        # fila para caber o None e derruba o socket de quem está parado no sendall
+        with self.lock:
+            clients = list(self.clients)
+        for q, request in clients:
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StreamClient:
+    # Lê o stream do daemon numa thread e entrega Samples por uma fila limitada,
+    # reconectando sozinho se o daemon cair
+    def __init__(self, host='127.0.0.1', port=3600, maxsize=1024, retry=2):
+        self.host = host
+        self.port = port
+        self.retry = retry
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='stream-client', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with socket.create_connection((self.host, self.port), timeout=self.retry) as sock:
+                    sock.settimeout(None)
+                    logger.info(f'Conectado ao stream em {self.host}:{self.port}')
+                    for line in sock.makefile('rb'):
+                        if self._stop.is_set():
+                            return
+                        item = json.loads(line)
+                        self._put(Sample(datetime.datetime.fromtimestamp(item['t']), item['peaks']))
+            except (OSError, ValueError) as e:
+                logger.warning(f'Stream indisponível ({e}), tentando de novo')
+            self._stop.wait(self.retry)
+
+    def _put(self, sample):
+        try:
+            self.queue.put_nowait(sample)
+        except queue.Full:
+            self.dropped += 1
+
+    def get_batch(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def close(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Aquisição do BraggMETER sem interface gráfica')
+    parser.add_argument('--host', action='append', metavar='HOST[:PORTA]',
+                        help='endereço do BraggMETER; repita para vários interrogadores, '
+                             'na ordem da coluna Interrogador (padrão: 10.0.0.150)')
+    parser.add_argument('--port', type=int, default=3500, help='porta para os endereços sem porta')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='diferença máxima, em segundos, entre amostras de interrogadores '
+                             'diferentes alinhadas juntas (padrão: metade do período)')
+    parser.add_argument('--config', default='sensor_data.xlsx', help='planilha de sensores')
+    parser.add_argument('--sheet', default='Grade', help='aba da planilha de sensores')
+    parser.add_argument('--interval', type=float, default=1, help='período de aquisição em segundos')
+    parser.add_argument('--overload', choices=Scheduler.policies, default='skip',
+                        help='o que fazer quando uma leitura não cabe no período')
+    parser.add_argument('--alarm-debounce', type=int, default=2,
+                        help='amostras seguidas para disparar ou normalizar um alarme')
+    parser.add_argument('--alarm-budget', type=float, default=0.2,
+                        help='latência máxima, em segundos, da resposta do interrogador até o alarme')
+    parser.add_argument('--output', default='medições', help='diretório das medições')
+    parser.add_argument('--format', choices=sorted(BACKENDS), default='csv',
+                        help='formato dos arquivos: csv ou brg (binário compacto, veja codec.py)')
+    parser.add_argument('--no-raw', action='store_true',
+                        help='grava só os agregados de 1 s, 1 min e 1 h, sem as amostras brutas')
+    parser.add_argument('--stream-port', type=int, default=3600, help='porta do stream ao vivo; 0 desativa')
+    parser.add_argument('--shm', default='braggmeter',
+                        help='nome do anel em memória compartilhada lido pela interface e outros '
+                             'processos locais; vazio desativa')
+    parser.add_argument('--shm-capacity', type=int, default=65536, help='amostras guardadas no anel')
+    parser.add_argument('--emulate', action='store_true', help='usa o emulador local do BraggMETER')
+    parser.add_argument('--metrics-port', type=int, default=0, help='porta do endpoint /metrics; 0 desativa')
+    parser.add_argument('--metrics-file', default=None, help='arquivo texto de métricas regravado a cada 10 s')
+    parser.add_argument('--no-metrics', action='store_true', help='desliga a coleta de métricas')
+    parser.add_argument('--log', default=None, help='arquivo de log (padrão: stderr)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format=FORMAT,
+                        datefmt='%d-%m-%Y %H:%M:%S', filename=args.log)
+    t0 = time.perf_counter()
+    metrics.set_enabled(not args.no_metrics)
+
+    sensors = SensorConfigCache().get(args.config, args.sheet)
+    ring = None
+    if args.shm:
+        # Antes de conectar: com outro daemon publicando no mesmo anel, não sobe
+        try:
+            ring = SampleRing(args.shm, sensors.names, capacity=args.shm_capacity)
+        except FileExistsError as e:
+            parser.error(str(e))
+    # Daqui em diante o anel já existe: qualquer falha (ex. ao conectar) o remove de /dev/shm
+    try:
+        emulators = []
+        hosts = []
+        for address in args.host or ['10.0.0.150']:
+            host, _, port = address.rpartition(':') if ':' in address else (address, None, None)
+            hosts.append((host, int(port) if port else args.port))
+        if args.emulate:
+            # Um emulador por interrogador da planilha, cada um com os seus sensores
+            from emulator import BraggMeterEmulator
+            hosts = []
+            for device in sensors.device_list():
+                emulator = BraggMeterEmulator().start()
+                mine = sensors.devices == device
+                emulator.set_sensors(sensors.lambdaBragg_0[mine], sensors.channels[mine])
+                emulators.append(emulator)
+                hosts.append((emulator.host, emulator.port))
+
+        storage = StorageWriter(BACKENDS[args.format](args.output))
+        meters = [BraggMeter(host=host, port=port) for host, port in hosts]
+        core = AcquisitionCore(meters, sensors, interval=args.interval, storage=storage, stream=args.sheet,
+                               tolerance=args.tolerance, policy=args.overload, raw=not args.no_raw,
+                               alarm_debounce=args.alarm_debounce, alarm_latency_budget=args.alarm_budget)
+        stream = None
+        if args.stream_port:
+            stream = StreamServer(port=args.stream_port)
+            core.subscribe(stream.publish)
+        if ring is not None:
+            core.subscribe(ring.publish)
+
+        exporters = []
+        if args.metrics_port:
+            exporters.append(metrics.MetricsServer(port=args.metrics_port))
+        if args.metrics_file:
+            exporters.append(metrics.TextfileExporter(args.metrics_file))
+
+        stop = threading.Event()
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        core.start()
+        logger.info(f'Aquisição iniciada em {time.perf_counter() - t0:.3f} s '
+                    f'({len(sensors)} sensores, {len(meters)} interrogador(es), período {args.interval} s)')
+        while not stop.wait(1):
+            pass
+
+        logger.info('Encerrando a aquisição')
+        core.stop()
+        storage.close()
+        if stream is not None:
+            stream.close()
+        for exporter in exporters:
+            exporter.close()
+        for emulator in emulators:
+            emulator.stop()
+    finally:
+        if ring is not None:
+            ring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import math
+import time
+import logging
+from PyQt5 import QtCore, QtWidgets
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DiagnosticsDock(QtWidgets.QDockWidget):
+    # Painel com as métricas de cada estágio, atualizado uma vez por segundo
+    # e só enquanto está visível
+    headers = ['Métrica', 'Valor', 'Taxa (/s)', 'p50 (ms)', 'p99 (ms)']
+
+    def __init__(self, parent=None, registry=metrics.REGISTRY, interval=1000):
+        super().__init__('Diagnóstico', parent)
+        self.setObjectName('diagnostics')
+        self.registry = registry
+        self.last = {}
+        self.last_time = None
+
+        self.table = QtWidgets.QTableWidget(0, len(self.headers))
+        self.table.setHorizontalHeaderLabels(self.headers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.setWidget(self.table)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.setInterval(interval)
+        self.visibilityChanged.connect(self.toggleTimer)
+
+    def toggleTimer(self, visible):
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        now = time.monotonic()
+        dt = now - self.last_time if self.last_time is not None else None
+        rows = self.registry.snapshot()
+        self.table.setRowCount(len(rows))
+        for r, (name, kind, value, p50, p99) in enumerate(rows):
+            rate = None
+            if kind != 'gauge' and dt and name in self.last:
+                rate = (value - self.last[name]) / dt
+            self.last[name] = value
+            cells = [name, f'{value:g}', self.format(rate, 1),
+                     self.format(p50, 1e3), self.format(p99, 1e3)]
+            for c, text in enumerate(cells):
+                item = self.table.item(r, c)
+                if item is None:
+                    item = QtWidgets.QTableWidgetItem()
+                    self.table.setItem(r, c, item)
+                item.setText(text)
+        self.last_time = now
+
+    @staticmethod
+    def format(value, scale):
+        if value is None or math.isnan(value):
+            return ''
+        return f'{value * scale:.3g}'
@@ -0,0 +1,150 @@
+import argparse
+import random
+import socketserver
+import threading
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class BraggMeterEmulator:
+    # Servidor TCP local que fala o mesmo protocolo do BraggMETER
+    # (:STAT?, :ACQU:STAR/STOP, :ACQU:WAVE:CHAN:n?, :ACQU:OSAT:CHAN:n? e a
+    # variante binária :ACQU:OSAT:CHAN:n:BIN?), para testar o caminho de I/O real.
+    # Status: 5 aquecendo, 1 parado, 3 adquirindo.
+    def __init__(self, host='127.0.0.1', port=0, channels=4, sensors_per_channel=8,
+                 latency=0.0, jitter=0.0, dropout=0.0, warmup=0.0, volatility=1e-3,
+                 trace_points=20000, seed=None):
+        self.host = host
+        self.requested_port = port
+        self.latency = latency          # segundos por resposta
+        self.jitter = jitter            # segundos, uniforme em [0, jitter)
+        self.dropout = dropout          # probabilidade de derrubar a conexão em vez de responder
+        self.warmup = warmup            # segundos em status 5 após iniciar
+        self.volatility = volatility    # nm por consulta, passeio aleatório
+        self.trace_points = trace_points
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.acquiring = False
+        self.started_at = None
+        self.server = None
+        self.thread = None
+        self.requests = 0
+
+        wl = np.linspace(1510, 1590, sensors_per_channel) if sensors_per_channel else np.empty(0)
+        self.set_sensors(np.tile(wl, channels), np.repeat(np.arange(channels), len(wl)))
+
+    def set_sensors(self, lambdaBragg_0, channels):
+        with self.lock:
+            self.lambdaBragg_0 = np.asarray(lambdaBragg_0, dtype=float)
+            self.lambdaBragg = self.lambdaBragg_0.copy()
+            self.channels = np.asarray(channels)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def status(self):
+        if self.started_at is not None and time.monotonic() - self.started_at < self.warmup:
+            return 5
+        return 3 if self.acquiring else 1
+
+    def peaks(self, channel):
+        with self.lock:
+            self.lambdaBragg += self.rng.normal(0, self.volatility, len(self.lambdaBragg))
+            return self.lambdaBragg[self.channels == channel]
+
+    def trace(self, channel):
+        wl = np.linspace(1500, 1600, self.trace_points)
+        trace = self.rng.normal(10, 0.5, self.trace_points)
+        for lambdaBragg in self.peaks(channel):
+            i = np.searchsorted(wl, lambdaBragg)
+            window = slice(max(0, i - 200), i + 200)
+            trace[window] += 1000 * np.exp(-((wl[window] - lambdaBragg) / 0.1) ** 2 / 2)
+        return trace
+
+    def reply(self, command):
+        if command == ':STAT?':
+            return f':ACK:{self.status()}'.encode()
+        if self.status() == 5:
+            return b':NAK'
+        if command == ':ACQU:STAR':
+            self.acquiring = True
+            return b':ACK'
+        if command == ':ACQU:STOP':
+            self.acquiring = False
+            return b':ACK'
+        if command.startswith(':ACQU:WAVE:CHAN:') and command.endswith('?'):
+            channel = int(command[len(':ACQU:WAVE:CHAN:'):-1])
+            if not self.acquiring:
+                return b':ACK:'
+            return (':ACK:' + ','.join(f'{wl:.6f}' for wl in self.peaks(channel))).encode()
+        if command.startswith(':ACQU:OSAT:CHAN:') and command.endswith(':BIN?'):
+            data = self.trace(int(command[len(':ACQU:OSAT:CHAN:'):-len(':BIN?')])).astype('<f4').tobytes()
+            size = str(len(data)).encode()
+            return b':ACK:#' + str(len(size)).encode() + size + data
+        if command.startswith(':ACQU:OSAT:CHAN:') and command.endswith('?'):
+            trace = self.trace(int(command[len(':ACQU:OSAT:CHAN:'):-1]))
+            return (':ACK:' + ','.join(f'{v:.3f}' for v in trace)).encode()
+        return b':NAK'
+
+    def start(self):
+        emulator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                for line in self.rfile:
+                    command = line.strip().decode('ascii', errors='replace')
+                    if not command:
+                        continue
+                    emulator.requests += 1
+                    if emulator.dropout and emulator.random.random() < emulator.dropout:
+                        logger.debug(f'Emulador: queda simulada em {command}')
+                        return
+                    delay = emulator.latency + emulator.jitter * emulator.random.random()
+                    if delay > 0:
+                        time.sleep(delay)
+                    self.wfile.write(emulator.reply(command) + b'\r\n')
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((self.host, self.requested_port), Handler)
+        self.server.daemon_threads = True
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self.server.serve_forever, name='emulator', daemon=True)
+        self.thread.start()
+        logger.info(f'Emulador do BraggMETER em {self.host}:{self.port}')
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulador do protocolo do BraggMETER')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3500)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--sensors', type=int, default=8, help='sensores por canal')
+    parser.add_argument('--latency', type=float, default=0.0, help='segundos por resposta')
+    parser.add_argument('--jitter', type=float, default=0.0, help='segundos')
+    parser.add_argument('--dropout', type=float, default=0.0, help='probabilidade de queda por comando')
+    parser.add_argument('--warmup', type=float, default=0.0, help='segundos em aquecimento (status 5)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = BraggMeterEmulator(args.host, args.port, channels=args.channels,
+                                  sensors_per_channel=args.sensors, latency=args.latency,
+                                  jitter=args.jitter, dropout=args.dropout, warmup=args.warmup).start()
+    try:
+        emulator.thread.join()
+    except KeyboardInterrupt:
+        emulator.stop()
@@ -0,0 +1,275 @@
+import datetime
+import io
+import json
+import os
+import threading
+import time
+import logging
+import numpy as np
+import codec
+
+logger = logging.getLogger(__name__)
+
+
+def stream_of(path):
+    # Mesmo critério do export_excel: <fluxo>_<data>.csv (ou .brg)
+    return os.path.basename(path).rsplit('_', 1)[0]
+
+
+def file_order(path):
+    # <fluxo>_<AAAAmmdd-HHMMSS>[-k].csv/.brg em ordem cronológica (o -k vem depois do arquivo sem sufixo)
+    stamp = os.path.splitext(os.path.basename(path))[0].rsplit('_', 1)[-1]
+    parts = stamp.split('-')
+    k = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+    return stream_of(path), '-'.join(parts[:2]), k
+
+
+def parse_times(strings):
+    # Horários ISO locais (como grava o CsvBackend) -> segundos desde a época.
+    # O numpy converte tudo de uma vez como se fosse UTC; a diferença para o fuso
+    # local é corrigida por bloco, e só linha a linha se o bloco cruzar uma troca de horário.
+    naive = np.array(strings, dtype='datetime64[us]').astype(np.int64) / 1e6
+    first = datetime.datetime.fromisoformat(strings[0]).timestamp() - naive[0]
+    last = datetime.datetime.fromisoformat(strings[-1]).timestamp() - naive[-1]
+    if first == last:
+        return naive + first
+    return np.array([datetime.datetime.fromisoformat(s).timestamp() for s in strings])
+
+
+class HistoryStore:
+    # Um fluxo gravado em disco em formato binário, lido por memmap:
+    #   time.bin / data.bin   todas as amostras (float64, linhas x colunas)
+    #   t_L / min_L / max_L   nível L da pirâmide: blocos de factor ** L amostras
+    # Só blocos completos entram na pirâmide; o final incompleto de cada nível é
+    # lido do nível de baixo. Uma consulta lê no máximo ~max_points linhas,
+    # qualquer que seja o tamanho do histórico.
+    factor = 16
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {'columns': None, 'sources': {}, 'levels': 0}
+        # lock: uma importação por vez (pode levar minutos); view_lock: só a troca
+        # das visões memmap, para a consulta nunca esperar uma importação
+        self.lock = threading.Lock()
+        self.view_lock = threading.Lock()
+        self._open()
+
+    @property
+    def columns(self):
+        return self.meta['columns'] or []
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _map(self, name, width=None):
+        # width None: vetor de horários; senão matriz (linhas x width)
+        path = self._file(name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        rows = size // (8 * (width or 1)) if width != 0 else 0
+        shape = (rows,) if width is None else (rows, width)
+        if rows == 0:
+            return np.empty(shape)
+        return np.memmap(path, dtype=np.float64, mode='r', shape=shape)
+
+    def _open(self):
+        # Um arquivo pode ter uma linha a mais que o outro se a importação foi interrompida
+        width = len(self.columns)
+        levels = []
+        names = [('time.bin', 'data.bin', 'data.bin')] + \
+                [(f't_{level}.bin', f'min_{level}.bin', f'max_{level}.bin')
+                 for level in range(1, self.meta['levels'] + 1)]
+        for t_name, min_name, max_name in names:
+            t, mn, mx = self._map(t_name), self._map(min_name, width), self._map(max_name, width)
+            n = min(len(t), len(mn), len(mx))
+            levels.append((t[:n], mn[:n], mx[:n]))
+        with self.view_lock:
+            self.levels = levels
+            self.time, self.data = levels[0][:2]
+        self.last_time = float(self.time[-1]) if len(self.time) else None
+
+    def __len__(self):
+        return len(self.time)
+
+    def append_csv(self, path, chunk_bytes=16 * 2 ** 20):
+        # Importa o que o arquivo ganhou desde a última vez (só linhas completas)
+        import pandas as pd
+        offset = self.meta['sources'].get(path, 0)
+        size = os.path.getsize(path)
+        if size <= offset:
+            return 0
+        added = 0
+        with open(path, 'rb') as f:
+            header = f.readline().decode('utf-8').rstrip('\r\n').split(',')
+            if self.meta['columns'] is None:
+                self.meta['columns'] = header[1:]
+            elif header[1:] != self.meta['columns']:
+                logger.warning(f'{path} tem outras colunas, não entra no histórico de {self.path}')
+                self.meta['sources'][path] = size
+                return 0
+            offset = max(offset, f.tell())
+            f.seek(offset)
+            while True:
+                chunk = f.read(chunk_bytes)
+                end = chunk.rfind(b'\n') + 1
+                if end == 0:
+                    break
+                f.seek(offset + end)
+                df = pd.read_csv(io.BytesIO(chunk[:end]), header=None, dtype={0: str})
+                added += self._append(path, parse_times(df[0].to_numpy()), df.iloc[:, 1:].to_numpy(dtype=np.float64))
+                offset += end
+                if len(chunk) < chunk_bytes:
+                    break
+        self.meta['sources'][path] = offset
+        return added
+
+    def append_binary(self, path):
+        # Mesmo que append_csv para os arquivos do BinaryBackend; a posição
+        # guardada é o fim do último bloco completo
+        offset = self.meta['sources'].get(path, 0)
+        if os.path.getsize(path) <= offset:
+            return 0
+        with open(path, 'rb') as f:
+            meta, _ = codec.read_header(f)
+        if self.meta['columns'] is None:
+            self.meta['columns'] = meta['columns']
+        elif meta['columns'] != self.meta['columns']:
+            logger.warning(f'{path} tem outras colunas, não entra no histórico de {self.path}')
+            self.meta['sources'][path] = os.path.getsize(path)
+            return 0
+        added = 0
+        for offset, timestamps, data in codec.iter_blocks(path, offset):
+            added += self._append(path, timestamps, data)
+            self.meta['sources'][path] = offset
+        return added
+
+    def _append(self, path, timestamps, data):
+        if self.last_time is not None and len(timestamps) and timestamps[0] < self.last_time:
+            # O histórico só cresce no tempo; linhas fora de ordem ficam de fora
+            keep = timestamps >= self.last_time
+            logger.warning(f'{np.count_nonzero(~keep)} linhas de {path} fora de ordem ignoradas')
+            timestamps, data = timestamps[keep], data[keep]
+        with open(self._file('time.bin'), 'ab') as out:
+            out.write(timestamps.tobytes())
+        if len(timestamps):
+            self.last_time = float(timestamps[-1])
+        with open(self._file('data.bin'), 'ab') as out:
+            out.write(np.ascontiguousarray(data).tobytes())
+        return len(timestamps)
+
+    def build_pyramid(self, chunk_blocks=65536):
+        # Completa cada nível com os blocos novos do nível de baixo, em pedaços
+        self._open()
+        width = len(self.columns)
+        level = 1
+        while True:
+            below_t, below_min, below_max = self.levels[level - 1]
+            if level < len(self.levels):
+                done = len(self.levels[level][0])
+            else:
+                done = 0
+            target = len(below_t) // self.factor
+            if target == 0:
+                break
+            for start in range(done, target, chunk_blocks):
+                stop = min(target, start + chunk_blocks)
+                a, b = start * self.factor, stop * self.factor
+                t = np.asarray(below_t[a:b:self.factor])
+                mn = np.fmin.reduce(np.asarray(below_min[a:b]).reshape(-1, self.factor, width), axis=1)
+                mx = np.fmax.reduce(np.asarray(below_max[a:b]).reshape(-1, self.factor, width), axis=1)
+                for name, values in ((f't_{level}.bin', t), (f'min_{level}.bin', mn), (f'max_{level}.bin', mx)):
+                    with open(self._file(name), 'ab') as out:
+                        out.write(np.ascontiguousarray(values).tobytes())
+            self.meta['levels'] = max(self.meta['levels'], level)
+            self._open()
+            level += 1
+        with open(self.meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def query(self, t0, t1, columns, max_points=4000):
+        # Retorna (x, y) para o intervalo [t0, t1]: amostras brutas se couberem em
+        # max_points, senão pares mín/máx do nível mais fino que caiba
+        # Lê um retrato dos níveis: os arquivos só crescem, então as visões antigas
+        # continuam válidas enquanto uma importação acrescenta linhas
+        with self.view_lock:
+            levels = self.levels
+        level = 0
+        i0, i1 = np.searchsorted(levels[0][0], [t0, t1])
+        rows = i1 - i0
+        while rows > max_points // 2 and level + 1 < len(levels):
+            level += 1
+            rows //= self.factor
+        return self._query_level(levels, level, t0, t1, columns), level
+
+    def _query_level(self, levels, level, t0, t1, columns):
+        t, mn, mx = levels[level]
+        time_ = levels[0][0]
+        i0 = max(0, np.searchsorted(t, t0) - 1)
+        i1 = np.searchsorted(t, t1, side='right') + 1
+        x = np.asarray(t[i0:i1])
+        if level == 0:
+            parts = [(x, np.asarray(mn[i0:i1][:, columns]))]
+        else:
+            lo = np.asarray(mn[i0:i1][:, columns])
+            hi = np.asarray(mx[i0:i1][:, columns])
+            # Cada bloco vira dois pontos (mín e máx) no mesmo horário
+            parts = [(np.repeat(x, 2), np.stack([lo, hi], axis=1).reshape(-1, len(columns)))]
+        # Amostras depois do último bloco completo deste nível vêm do nível de baixo
+        covered = len(t) * self.factor ** level
+        if level > 0 and covered < len(time_) and t1 >= time_[covered]:
+            tail = time_[covered]
+            below_x, below_y = self._query_level(levels, level - 1, max(t0, tail), t1, columns)
+            first = np.searchsorted(below_x, tail)
+            parts.append((below_x[first:], below_y[first:]))
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def span(self):
+        if len(self.time) == 0:
+            return None
+        return float(self.time[0]), float(self.time[-1])
+
+
+class HistoryArchive:
+    # Um HistoryStore por fluxo, sob root, alimentados pelos arquivos do CsvBackend ou do BinaryBackend.
+    # Use um único objeto por root: as travas que serializam as importações são dele.
+    def __init__(self, root):
+        self.root = root
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    def update(self, csv_paths):
+        t0 = time.perf_counter()
+        added = 0
+        by_stream = {}
+        for path in sorted(csv_paths, key=file_order):
+            by_stream.setdefault(stream_of(path), []).append(path)
+        for stream, paths in by_stream.items():
+            store = self.open(stream)
+            with store.lock:
+                for path in paths:
+                    path = os.path.abspath(path)
+                    if path.endswith(codec.EXTENSION):
+                        added += store.append_binary(path)
+                    else:
+                        added += store.append_csv(path)
+                store.build_pyramid()
+        logger.info(f'Histórico atualizado: {added} amostras novas em {time.perf_counter() - t0:.2f} s')
+        return added
+
+    def streams(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, 'meta.json')))
+
+    def open(self, stream):
+        with self.lock:
+            if stream not in self.stores:
+                self.stores[stream] = HistoryStore(os.path.join(self.root, stream))
+            return self.stores[stream]
@@ -0,0 +1,116 @@
+import threading
+import time
+import logging
+from PyQt5 import QtCore, QtWidgets
+from pyqtgraph import PlotWidget, PlotCurveItem, DateAxisItem, mkPen
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWindow(QtWidgets.QMainWindow):
+    # Navegação pelas medições gravadas: importa os CSVs novos para o histórico
+    # (memmap + pirâmide mín/máx) numa thread e, a cada pan/zoom, redesenha só o
+    # intervalo visível com no máximo max_points pontos por curva
+    imported = QtCore.pyqtSignal(int)
+    colors = ['k', 'b', 'c', 'r', 'g', 'y']
+
+    def __init__(self, csv_paths, archive, parent=None, max_points=4000, max_curves=6):
+        # archive: o HistoryArchive compartilhado da janela principal
+        super().__init__(parent)
+        self.setWindowTitle('Histórico (importando...)')
+        self.resize(1000, 600)
+        self.archive = archive
+        self.max_points = max_points
+        self.max_curves = max_curves
+        self.store = None
+        self.curves = []
+
+        self.streamBox = QtWidgets.QComboBox()
+        self.columnList = QtWidgets.QListWidget()
+        side = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(side)
+        layout.addWidget(QtWidgets.QLabel('Fluxo'))
+        layout.addWidget(self.streamBox)
+        layout.addWidget(QtWidgets.QLabel('Colunas'))
+        layout.addWidget(self.columnList)
+
+        self.plot = PlotWidget(axisItems={'bottom': DateAxisItem()})
+        self.plot.setBackground('w')
+        self.plot.getAxis('bottom').setLabel('Horário')
+        self.plot.setClipToView(True)
+
+        splitter = QtWidgets.QSplitter()
+        splitter.addWidget(side)
+        splitter.addWidget(self.plot)
+        splitter.setStretchFactor(1, 1)
+        self.setCentralWidget(splitter)
+
+        # Pan/zoom gera muitos eventos; a consulta roda uma vez quando eles param
+        self.redrawTimer = QtCore.QTimer(self)
+        self.redrawTimer.setSingleShot(True)
+        self.redrawTimer.setInterval(30)
+        self.redrawTimer.timeout.connect(self.redraw)
+        self.plot.getViewBox().sigXRangeChanged.connect(lambda *_: self.redrawTimer.start())
+
+        self.streamBox.currentTextChanged.connect(self.openStream)
+        self.columnList.itemChanged.connect(lambda *_: self.setupCurves())
+        self.imported.connect(self.importDone)
+        threading.Thread(target=self._import, args=(list(csv_paths),), name='history', daemon=True).start()
+
+    def _import(self, csv_paths):
+        try:
+            added = self.archive.update(csv_paths)
+        except Exception as e:
+            logger.error(f'Erro ao importar o histórico: {e}')
+            added = -1
+        self.imported.emit(added)
+
+    def importDone(self, added):
+        self.setWindowTitle('Histórico')
+        if added < 0:
+            self.statusBar().showMessage('Erro ao importar as medições, veja o log')
+        self.streamBox.addItems(self.archive.streams())
+
+    def openStream(self, stream):
+        self.store = self.archive.open(stream)
+        self.columnList.blockSignals(True)
+        self.columnList.clear()
+        # Por padrão as deformações (ou as primeiras colunas, nos agregados)
+        default = [i for i, c in enumerate(self.store.columns) if c.startswith('Strain')][:self.max_curves] \
+            or list(range(min(self.max_curves, len(self.store.columns))))
+        for i, column in enumerate(self.store.columns):
+            item = QtWidgets.QListWidgetItem(column)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked if i in default else QtCore.Qt.Unchecked)
+            self.columnList.addItem(item)
+        self.columnList.blockSignals(False)
+        self.setupCurves()
+        span = self.store.span()
+        if span is not None:
+            self.plot.setXRange(*span, padding=0.02)
+
+    def selected(self):
+        return [i for i in range(self.columnList.count())
+                if self.columnList.item(i).checkState() == QtCore.Qt.Checked]
+
+    def setupCurves(self):
+        for curve in self.curves:
+            self.plot.removeItem(curve)
+        self.columns = self.selected()
+        self.curves = []
+        for k, _ in enumerate(self.columns):
+            curve = PlotCurveItem(pen=mkPen(color=self.colors[k % len(self.colors)], width=1))
+            self.plot.addItem(curve)
+            self.curves.append(curve)
+        self.redraw()
+
+    def redraw(self):
+        if self.store is None or not self.columns or len(self.store) == 0:
+            return
+        t0, t1 = self.plot.getViewBox().viewRange()[0]
+        start = time.perf_counter()
+        (x, y), level = self.store.query(t0, t1, self.columns, self.max_points)
+        for k, curve in enumerate(self.curves):
+            curve.setData(x, y[:, k], connect='finite')
+        self.statusBar().showMessage(f'{len(x)} pontos, nível {level}, '
+                                     f'{(time.perf_counter() - start) * 1e3:.1f} ms')
@@ -1,6 +1,10 @@
+import time
+t_start = time.perf_counter()
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
 from MainWindow import MainWindow
 from sys import argv
+import argparse
 import logging
 logger = logging.getLogger(__name__)
 
@@ -8,11 +12,39 @@ FORMAT = '%(asctime)s @ %(name)s (%(levelname)s) >> %(message)s'
 logging.basicConfig(level=logging.INFO, format=FORMAT, datefmt='%d-%m-%Y %H:%M:%S',
                     filename='info.log')
 
+
+def shown(quit_after=False):
+    # Chamado na primeira volta do loop de eventos, com a janela já desenhada
+    elapsed = time.perf_counter() - t_start
+    logger.info(f'Janela exibida em {elapsed * 1e3:.0f} ms')
+    if quit_after:
+        print(f'{elapsed * 1e3:.0f} ms')
+        QApplication.instance().quit()
+
+
 if __name__ == '__main__':
     logger.debug(f'Iniciando...')
 
-    app = QApplication(argv)
-    w = MainWindow()
+    parser = argparse.ArgumentParser(description='Interface do BraggMETER')
+    parser.add_argument('--attach', metavar='HOST:PORTA', default=None,
+                        help='só exibe o stream de um daemon (python daemon.py) em vez de abrir o BraggMETER')
+    parser.add_argument('--shm', metavar='NOME', default=None,
+                        help='como --attach, mas lendo o anel em memória compartilhada de um daemon local')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='mede o tempo até a janela aparecer e sai')
+    args, qt_args = parser.parse_known_args(argv[1:])
+    attach = None
+    if args.attach is not None:
+        host, _, port = args.attach.rpartition(':')
+        attach = (host or '127.0.0.1', int(port))
+    if args.shm is not None:
+        attach = args.shm
+
+    app = QApplication(argv[:1] + qt_args)
+    w = MainWindow(attach=attach)
     w.show()
+    QTimer.singleShot(0, lambda: shown(args.startup_time))
 
-    app.exec()
\ No newline at end of file
+    app.exec()
+    if args.startup_time:
+        w.close()
@@ -0,0 +1,270 @@
+import bisect
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+clock = time.perf_counter
+
+# Limites dos baldes em segundos, de 10 us a ~80 s (fator 2)
+DEFAULT_BUCKETS = tuple(1e-5 * 2 ** i for i in range(24))
+
+
+class Counter:
+    def __init__(self, registry, name, help=''):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.value += n
+
+
+class Gauge:
+    # Valor instantâneo; com fn, é lido só na hora de exportar (ex.: tamanho de fila)
+    def __init__(self, registry, name, help='', fn=None):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, fn):
+        self.fn = fn
+
+    @property
+    def value(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float('nan')
+        return self._value
+
+
+class Histogram:
+    # Contagens por balde fixo: observar custa uma busca binária e uma soma,
+    # sem guardar as amostras
+    def __init__(self, registry, name, help='', buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # o último é +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        if not self.registry.enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def observe_since(self, t0):
+        # t0 vem de metrics.clock()
+        if self.registry.enabled:
+            self.observe(clock() - t0)
+
+    def time(self):
+        return _Timer(self) if self.registry.enabled else _NULL_TIMER
+
+    def quantile(self, q):
+        # Interpola linearmente dentro do balde; nan se não houver observações
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return float('nan')
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n > 0:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class _Timer:
+    __slots__ = ('histogram', 't0')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(clock() - self.t0)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    # Métricas por estágio da cadeia de aquisição. enabled pode ser trocado a
+    # qualquer momento; desligado, cada ponto de medição custa só uma checagem.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Métrica {name} já existe com outro tipo')
+            return metric
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help='', fn=None):
+        gauge = self._get(Gauge, name, help)
+        if fn is not None:
+            gauge.set_function(fn)
+        return gauge
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def snapshot(self):
+        # Lista de (nome, tipo, valor, p50, p99) para exibição
+        with self.lock:
+            metrics = list(self.metrics.values())
+        rows = []
+        for m in metrics:
+            if isinstance(m, Histogram):
+                rows.append((m.name, 'histogram', m.count, m.quantile(0.5), m.quantile(0.99)))
+            elif isinstance(m, Counter):
+                rows.append((m.name, 'counter', m.value, None, None))
+            else:
+                rows.append((m.name, 'gauge', m.value, None, None))
+        return rows
+
+    def render(self):
+        # Formato texto do Prometheus
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            if m.help:
+                lines.append(f'# HELP {m.name} {m.help}')
+            if isinstance(m, Histogram):
+                lines.append(f'# TYPE {m.name} histogram')
+                with m.lock:
+                    counts, total, count = list(m.counts), m.sum, m.count
+                cumulative = 0
+                for le, n in zip(m.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{m.name}_bucket{{le="{le:.6g}"}} {cumulative}')
+                lines.append(f'{m.name}_bucket{{le="+Inf"}} {count}')
+                lines.append(f'{m.name}_sum {total:.9g}')
+                lines.append(f'{m.name}_count {count}')
+            else:
+                kind = 'counter' if isinstance(m, Counter) else 'gauge'
+                lines.append(f'# TYPE {m.name} {kind}')
+                lines.append(f'{m.name} {m.value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # Troca atômica: quem lê (ex.: node_exporter) nunca vê um arquivo pela metade
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+def set_enabled(enabled):
+    REGISTRY.enabled = enabled
+
+
+class MetricsServer:
+    # Endpoint local GET /metrics
+    def __init__(self, host='127.0.0.1', port=9400, registry=REGISTRY):
+        # Importado aqui: metrics entra na partida da interface, o servidor HTTP não
+        import http.server
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+        logger.info(f'Métricas em http://{host}:{self.port}/metrics')
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TextfileExporter:
+    # Regrava o arquivo de métricas periodicamente
+    def __init__(self, path, interval=10, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-file', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            self.registry.write_textfile(self.path)
+        except OSError as e:
+            logger.error(f'Erro ao gravar as métricas em {self.path}: {e}')
+
+    def close(self):
+        self._stop.set()
+        self.thread.join()
+        self.write()
@@ -0,0 +1,64 @@
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+
+def detect_peaks(wl, spectra, method='parabolic', rel_height=0.3, snr=10, min_distance=0.5, half_width=3):
+    # Detecta e refina os picos de todos os canais numa só passada.
+    # wl: eixo de comprimento de onda (n,) uniforme; spectra: (canais, n).
+    # method: 'parabolic' (parábola por mínimos quadrados em ±half_width pontos),
+    # 'gaussian' (a mesma parábola no log do sinal, exata para um pico gaussiano
+    # em escala linear) ou 'centroid'.
+    # Retorna uma lista com os comprimentos de onda dos picos de cada canal.
+    spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+    n_channels, n = spectra.shape
+    dx = (wl[-1] - wl[0]) / (n - 1)
+    h = half_width
+
+    # Nível de corte: fração da altura do maior pico e snr vezes o ruído (MAD das diferenças)
+    baseline = np.median(spectra, axis=1, keepdims=True)
+    noise = 1.4826 / np.sqrt(2) * np.median(np.abs(np.diff(spectra, axis=1)), axis=1, keepdims=True)
+    level = baseline + np.maximum(rel_height * (spectra.max(axis=1, keepdims=True) - baseline), snr * noise)
+
+    # Máximo local dentro de ±min_distance e acima do nível de corte
+    m = max(1, int(round(min_distance / dx)))
+    padded = np.pad(spectra, ((0, 0), (m, m)), constant_values=-np.inf)
+    local_max = sliding_window_view(padded, 2 * m + 1, axis=1).max(axis=2)
+    is_peak = (spectra == local_max) & (spectra > level)
+    is_peak[:, 1:] &= spectra[:, 1:] > spectra[:, :-1]       # um pico por platô
+    is_peak[:, :h] = False
+    is_peak[:, n - h:] = False
+    ch, i = np.nonzero(is_peak)
+
+    offsets = np.arange(-h, h + 1)
+    y = spectra[ch[:, np.newaxis], i[:, np.newaxis] + offsets]
+    if method == 'centroid':
+        weights = np.clip(y - level[ch], 0, None)
+        delta = (weights * offsets).sum(axis=1) / weights.sum(axis=1)
+    else:
+        if method == 'gaussian':
+            y = np.log(np.clip(y - baseline[ch], np.finfo(float).tiny, None))
+        elif method != 'parabolic':
+            raise ValueError(f'Método de ajuste desconhecido: {method}')
+        # Mínimos quadrados y = a + b*k + c*k² com a mesma matriz para todos os picos
+        coef = y @ np.linalg.pinv(np.vander(offsets, 3, increasing=True)).T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(coef[:, 2] < 0, -coef[:, 1] / (2 * coef[:, 2]), 0)
+        delta = np.clip(delta, -h, h)
+
+    peaks = wl[0] + (i + delta) * dx
+    return np.split(peaks, np.cumsum(np.bincount(ch, minlength=n_channels))[:-1])
+
+
+def peak_discrepancy(reference, detected):
+    # Distância de cada pico de referência (ex.: do interrogador) ao pico detectado mais próximo
+    reference = np.asarray(reference, dtype=float)
+    detected = np.sort(np.asarray(detected, dtype=float))
+    if len(detected) == 0:
+        return np.full(len(reference), np.inf)
+    pos = np.clip(np.searchsorted(detected, reference), 1, max(1, len(detected) - 1))
+    left = detected[pos - 1]
+    right = detected[np.minimum(pos, len(detected) - 1)]
+    return np.minimum(np.abs(reference - left), np.abs(reference - right))
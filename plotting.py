@@ -0,0 +1,93 @@
+import logging
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer
+from buffer import SampleBuffer
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REDRAW = metrics.histogram('plot_redraw_seconds', 'Redesenho das curvas ao vivo')
+
+
+def minmax_decimate(x, y, n_out):
+    # Reduz (n, curvas) para ~n_out pontos por curva mantendo o mínimo e o máximo
+    # de cada bloco, na ordem em que aparecem, para não esconder picos
+    n = len(x)
+    bins = n_out // 2
+    if n <= n_out or bins == 0:
+        return np.repeat(x[:, np.newaxis], y.shape[1], axis=1), y
+    per = n // bins
+    start = n - bins * per      # descarta o início, a parte mais antiga
+    blocks = y[start:].reshape(bins, per, -1)
+    finite = ~np.isnan(blocks)
+    imin = np.where(finite, blocks, np.inf).argmin(axis=1)
+    imax = np.where(finite, blocks, -np.inf).argmax(axis=1)
+    idx = np.sort(np.stack([imin, imax], axis=1), axis=1)      # (bins, 2, curvas)
+    idx = (idx + start + per * np.arange(bins)[:, np.newaxis, np.newaxis]).reshape(2 * bins, -1)
+    return x[idx], np.take_along_axis(y, idx, axis=0)
+
+
+def plot_capacity(window, rate, n_curves, max_values=2000000):
+    # Amostras por curva para window segundos a rate amostras/s, com no máximo
+    # max_values valores somando todas as curvas
+    return max(2, min(int(np.ceil(window * rate)) + 1, max_values // max(1, n_curves)))
+
+
+class LivePlotter(QObject):
+    # Guarda as últimas amostras de cada curva num buffer circular e redesenha
+    # todas as curvas de uma vez, no máximo fps vezes por segundo,
+    # independente da taxa de chegada dos dados. O buffer guarda window * rate
+    # amostras por curva, limitado a max_values valores somando todas as curvas.
+    def __init__(self, plot_widget, *args, window=60, rate=100, max_values=2000000, fps=20, max_points=2000,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plot_widget = plot_widget
+        self.window = window            # segundos visíveis
+        self.rate = rate                # amostras por segundo, no máximo (período de 0,01 s)
+        self.max_values = max_values
+        self.capacity = 0
+        self.max_points = max_points
+        self.curves = []
+        self.buffer = None
+        self.dirty = False
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.redraw)
+        self.timer.setInterval(int(1000 / fps))
+        self.timer.start()
+
+    def set_curves(self, curves):
+        self.curves = list(curves)
+        needed = int(np.ceil(self.window * self.rate)) + 1
+        self.capacity = plot_capacity(self.window, self.rate, len(self.curves), self.max_values)
+        if self.capacity < needed:
+            logger.warning(f'{len(self.curves)} curvas: o gráfico guarda {self.capacity} amostras por curva, '
+                           f'{self.capacity / self.rate:.0f} s a {self.rate:g} amostras/s')
+        self.buffer = SampleBuffer(range(len(self.curves)), capacity=self.capacity,
+                                   flush_rows=self.capacity)
+        self.dirty = False
+
+    def append(self, timestamps, values):
+        # timestamps em segundos (epoch), values (amostras x curvas)
+        if self.buffer is None or len(self.curves) == 0:
+            return
+        self.buffer.extend(timestamps, values)
+        self.buffer.mark_flushed()
+        self.dirty = True
+
+    def redraw(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        t0 = metrics.clock()
+        timestamps, values = self.buffer.last()
+        xmax = timestamps[-1]
+        i = np.searchsorted(timestamps, xmax - self.window)
+        x, y = minmax_decimate(timestamps[i:], values[i:], self.max_points)
+        for k, curve in enumerate(self.curves):
+            curve.setData(x[:, k], y[:, k], connect='finite')
+        self.plot_widget.setXRange(xmax - self.window, xmax, padding=0)
+        REDRAW.observe_since(t0)
+
+    def stop(self):
+        self.timer.stop()
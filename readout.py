@@ -0,0 +1,94 @@
+import collections
+import datetime
+import math
+import logging
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REFRESH = metrics.histogram('gui_readout_seconds', 'Atualização da tabela e do histórico de medições')
+
+
+class LiveReadout(QtCore.QObject):
+    # Últimos valores de cada sensor numa tabela de tamanho fixo e um histórico em
+    # texto com no máximo max_lines linhas (uma por amostra). As amostras só são
+    # acumuladas em update(); a tela é atualizada no máximo fps vezes por segundo.
+    headers = ['Sensor', 'Bragg (nm)', 'Valor']
+
+    def __init__(self, table, log, *args, fps=10, max_lines=5000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table = table
+        self.log = log
+        self.log.setMaximumBlockCount(max_lines)
+        self.log.setUndoRedoEnabled(False)
+        self.lines = collections.deque(maxlen=max_lines)
+        self.latest = None
+        self.sensors = None
+
+        self.table.setColumnCount(len(self.headers))
+        self.table.setHorizontalHeaderLabels(self.headers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.setInterval(int(1000 / fps))
+        self.timer.start()
+
+    def set_sensors(self, sensors):
+        # Linhas fixas: horário, temperatura média e um sensor por linha
+        self.sensors = sensors
+        self.shown = np.flatnonzero(sensors.is_temp | sensors.is_strain)
+        self.units = np.where(sensors.is_temp, '°C', 'ue')
+        rows = [('Horário', ''), ('Temperatura média', '')] + [(sensors.names[i], '') for i in self.shown]
+        self.table.setRowCount(len(rows))
+        for r, (name, _) in enumerate(rows):
+            for c in range(len(self.headers)):
+                self.table.setItem(r, c, QtWidgets.QTableWidgetItem(name if c == 0 else ''))
+        self.latest = None
+
+    def update(self, timestamps, n_peaks, lambdaBragg, temperature, mean_temperature, strain):
+        # Um lote já convertido (amostras x sensores); n_peaks[j] é o total de picos da amostra j
+        if self.sensors is None or len(timestamps) == 0:
+            return
+        values = np.where(self.sensors.is_temp, temperature, strain)
+        names = self.sensors.names
+        strain_idx = np.flatnonzero(self.sensors.is_strain)
+        for j, timestamp in enumerate(timestamps):
+            if n_peaks[j] == 0:
+                self.lines.append(f'{timestamp}  FALHA MÁXIMA NA AQUISIÇÃO!!!!!!')
+                continue
+            fields = [f'{timestamp}', f'T {self.format(mean_temperature[j])} °C']
+            fields += [f'{names[i]} {self.format(strain[j, i])} ue' for i in strain_idx]
+            self.lines.append('  '.join(fields))
+        self.latest = (timestamps[-1], lambdaBragg[-1], values[-1], mean_temperature[-1])
+
+    @staticmethod
+    def format(value):
+        return 'falha' if math.isnan(value) else f'{value:.3f}'
+
+    def refresh(self):
+        if self.latest is None and not self.lines:
+            return
+        t0 = metrics.clock()
+        if self.latest is not None:
+            timestamp, lambdaBragg, values, mean_temperature = self.latest
+            self.latest = None
+            if isinstance(timestamp, datetime.datetime):
+                timestamp = timestamp.strftime('%d/%m/%Y %H:%M:%S.%f')[:-3]
+            self.table.item(0, 2).setText(str(timestamp))
+            self.table.item(1, 2).setText(f'{self.format(mean_temperature)} °C')
+            for r, i in enumerate(self.shown, start=2):
+                self.table.item(r, 1).setText(f'{lambdaBragg[i]:.4f}' if lambdaBragg[i] else '-')
+                self.table.item(r, 2).setText(f'{self.format(values[i])} {self.units[i]}')
+        if self.lines:
+            self.log.appendPlainText('\n'.join(self.lines))
+            self.lines.clear()
+        REFRESH.observe_since(t0)
+
+    def stop(self):
+        self.timer.stop()
+        self.refresh()
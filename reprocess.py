@@ -0,0 +1,173 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import glob
+import io
+import json
+import os
+import time
+import logging
+import numpy as np
+import codec
+from sensor_config import compile_sheet
+from history import file_order
+
+logger = logging.getLogger(__name__)
+
+FORMAT = '%(asctime)s @ %(name)s (%(levelname)s) >> %(message)s'
+BRAGG_PREFIX = 'Bragg (nm) @ '
+
+# Estado de cada processo do pool, preenchido uma vez por _init
+_sensors = None
+
+
+def _init(sensors):
+    global _sensors
+    _sensors = sensors
+
+
+def split_file(path, chunk_bytes):
+    # Divide o arquivo em faixas de bytes que terminam em fim de linha (ou de
+    # bloco, nos .brg); a primeira começa depois do cabeçalho
+    if path.endswith(codec.EXTENSION):
+        meta, ranges = codec.block_ranges(path, chunk_bytes)
+        return [meta['time_column']] + meta['columns'], ranges
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header.decode('utf-8').rstrip('\r\n').split(','), ranges
+
+
+def process_chunk(path, start, end, source):
+    # source[i]: coluna do arquivo com o Bragg do sensor i, ou -1 se ele não foi gravado.
+    # Retorna as linhas convertidas já em texto, com o horário original.
+    import pandas as pd
+    with open(path, 'rb') as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    if path.endswith(codec.EXTENSION):
+        with open(path, 'rb') as f:
+            meta, _ = codec.read_header(f)
+        timestamps, data = codec.decode_blocks(raw, meta['resolutions'])
+        stamps = [datetime.datetime.fromtimestamp(t).isoformat(sep=' ') for t in timestamps]
+        # Índices de source contam a coluna de horário
+        columns = {c: data[:, c - 1] for c in source if c > 0}
+    else:
+        used = sorted(set(int(c) for c in source if c >= 0))
+        df = pd.read_csv(io.BytesIO(raw), header=None, usecols=[0] + used, dtype={0: str})
+        stamps = df[0]
+        columns = {c: df[c].to_numpy(dtype=float) for c in used}
+    lambdaBragg = np.zeros((len(stamps), len(_sensors)))
+    for i, c in enumerate(source):
+        if c >= 0:
+            lambdaBragg[:, i] = columns[c]
+    lambdaBragg[np.isnan(lambdaBragg)] = 0       # falha gravada como NaN volta a ser "sem pico"
+    rows = _sensors.table(lambdaBragg, *_sensors.convert(lambdaBragg))
+    body = io.StringIO()
+    np.savetxt(body, rows, delimiter=',', fmt='%.10g')
+    return ''.join(f'{stamp},{row}\n' for stamp, row in zip(stamps, body.getvalue().splitlines())), len(stamps)
+
+
+def next_version(output, sheet):
+    k = 1
+    while os.path.exists(os.path.join(output, f'{sheet}_v{k}')):
+        k += 1
+    return os.path.join(output, f'{sheet}_v{k}')
+
+
+def reprocess(paths, config, sheet, output='reprocessado', workers=None, chunk_bytes=8 * 2 ** 20):
+    # Recalcula temperatura e deformação dos CSVs gravados a partir das colunas
+    # "Bragg (nm) @ sensor", com a calibração atual da aba. Cada execução grava uma
+    # versão nova (<aba>_vN) com um manifest.json; nada é sobrescrito.
+    t0 = time.perf_counter()
+    sensors = compile_sheet(config, sheet)
+    directory = next_version(output, sheet)
+    os.makedirs(directory)
+    manifest = {'config': os.path.abspath(config), 'sheet': sheet,
+                'config_mtime': os.path.getmtime(config),
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'sensors': sensors.names.tolist(), 'files': []}
+    header = ','.join(['Horário'] + sensors.columns()) + '\n'
+
+    workers = workers or os.cpu_count()
+    total = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                                                initargs=(sensors,)) as pool:
+        for path in paths:
+            columns, ranges = split_file(path, chunk_bytes)
+            position = {column: k for k, column in enumerate(columns)}
+            source = np.array([position.get(BRAGG_PREFIX + name, -1) for name in sensors.names])
+            missing = sensors.names[source < 0].tolist()
+            if missing:
+                logger.warning(f'{path} não tem o Bragg de {missing}; esses sensores ficam em branco')
+            # A saída é sempre CSV, para abrir direto em qualquer ferramenta
+            out_path = os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + '.csv')
+            rows = 0
+            with open(out_path, 'w', encoding='utf-8', newline='') as out:
+                out.write(header)
+                # Mantém no máximo 2 pedaços por processo em andamento, gravando na ordem
+                pending = collections.deque()
+                for start, end in ranges:
+                    pending.append(pool.submit(process_chunk, path, start, end, source))
+                    if len(pending) >= 2 * workers:
+                        text, n = pending.popleft().result()
+                        out.write(text)
+                        rows += n
+                while pending:
+                    text, n = pending.popleft().result()
+                    out.write(text)
+                    rows += n
+            total += rows
+            manifest['files'].append({'source': os.path.abspath(path), 'output': os.path.basename(out_path),
+                                      'rows': rows, 'missing_sensors': missing})
+            logger.info(f'{path}: {rows} linhas -> {out_path}')
+
+    elapsed = time.perf_counter() - t0
+    manifest['rows'] = total
+    manifest['seconds'] = round(elapsed, 3)
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    logger.info(f'{total} linhas reprocessadas em {elapsed:.1f} s ({workers} processos) em {directory}')
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reprocessa medições gravadas com uma calibração nova')
+    parser.add_argument('inputs', nargs='+', help='arquivos (CSV ou .brg) ou diretórios com as medições')
+    parser.add_argument('--config', default='sensor_data.xlsx', help='planilha de sensores com a calibração nova')
+    parser.add_argument('--sheet', default='Grade', help='aba da planilha de sensores')
+    parser.add_argument('--stream', default=None,
+                        help='nos diretórios, só os arquivos deste fluxo (padrão: o nome da aba)')
+    parser.add_argument('--output', default='reprocessado', help='diretório das versões reprocessadas')
+    parser.add_argument('--workers', type=int, default=None, help='processos (padrão: todos os núcleos)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format=FORMAT,
+                        datefmt='%d-%m-%Y %H:%M:%S')
+    stream = args.stream or args.sheet
+    paths = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            # Só o fluxo bruto: os agregados (<fluxo>_1s etc.) não têm o Bragg de cada amostra
+            paths += sorted((p for p in glob.glob(os.path.join(item, f'{stream}_*'))
+                             if p.endswith(('.csv', codec.EXTENSION)) and os.path.basename(p).rsplit('_', 1)[0] == stream),
+                            key=file_order)
+        else:
+            paths.append(item)
+    if not paths:
+        parser.error('nenhum arquivo de medição encontrado')
+    reprocess(paths, args.config, args.sheet, args.output, args.workers)
+
+
+if __name__ == '__main__':
+    main()
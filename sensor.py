@@ -1,3 +1,4 @@
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
@@ -53,3 +54,305 @@ class StrainSensor(Sensor):
         if temperature is None:
             temperature = self.t0
         self.temperature = temperature
+
+
+def _join(peaks_per_channel):
+    arrays = [np.asarray(p, dtype=float).ravel() for p in peaks_per_channel if p is not None]
+    return np.concatenate(arrays) if arrays else np.empty(0)
+
+
+class SensorArray:
+    # Parâmetros de calibração de todos os sensores em colunas, para converter
+    # todos os sensores (e várias amostras) numa única chamada.
+    # Sensores com falha (lambdaBragg == 0) resultam em NaN.
+    # devices identifica o interrogador de cada sensor quando há mais de um.
+    # Limites de alarme na unidade do sensor (°C ou ue); NaN desativa.
+    max_distance = 2.5      # nm
+
+    def __init__(self, names, types, channels, lambdaBragg_0,
+                 s0=None, s1=None, s2=None, k=None, tcs=None, cte=None, T0=None, devices=None,
+                 alarm_min=None, alarm_max=None, alarm_rate=None, hysteresis=None):
+        n = len(names)
+        self.names = np.asarray(names, dtype=object)
+        self.types = np.asarray(types, dtype=object)
+        self.channels = np.asarray(channels)
+        self.devices = np.zeros(n, dtype=np.int64) if devices is None else np.asarray(devices, dtype=np.int64)
+        self.lambdaBragg_0 = np.asarray(lambdaBragg_0, dtype=float)
+
+        def column(values):
+            if values is None:
+                return np.full(n, np.nan)
+            return np.asarray(values, dtype=float)
+
+        self.s0 = column(s0)
+        self.s1 = column(s1)
+        self.s2 = column(s2)
+        self.k = column(k)
+        self.tcs = column(tcs)
+        self.cte = column(cte)
+        self.T0 = column(T0)
+        self.alarm_min = column(alarm_min)
+        self.alarm_max = column(alarm_max)
+        self.alarm_rate = column(alarm_rate)
+        self.hysteresis = np.zeros(n) if hysteresis is None else np.nan_to_num(np.asarray(hysteresis, dtype=float))
+
+        self.is_temp = self.types == 'Temperatura'
+        self.is_strain = self.types == 'Deformação'
+        self.order = np.argsort(self.lambdaBragg_0, kind='stable')
+        self.groups = None
+
+    @classmethod
+    def from_dataframe(cls, df):
+        def column(name):
+            return df[name].to_numpy(dtype=float) if name in df else None
+
+        return cls(df['Sensor'].astype(str).to_numpy(),
+                   df['Tipo'].to_numpy(),
+                   df['Canal'].to_numpy(),
+                   df['Lambda Bragg (nm)'].to_numpy(dtype=float),
+                   s0=column('s0 (°C)'),
+                   s1=column('s1 (°C/nm)'),
+                   s2=column('s2 (°C/nm²)'),
+                   k=column('k'),
+                   tcs=column('tcs (um/m/°C)'),
+                   cte=column('cte (um/m/°C)'),
+                   T0=column('T0 (°C)'),
+                   devices=df['Interrogador'].fillna(0).to_numpy(dtype=np.int64) if 'Interrogador' in df else None,
+                   alarm_min=column('Alarme mín'),
+                   alarm_max=column('Alarme máx'),
+                   alarm_rate=column('Alarme taxa (/s)'),
+                   hysteresis=column('Histerese'))
+
+    def save(self, path, mtime=0):
+        np.savez(path, names=self.names.astype(str), types=self.types.astype(str), channels=self.channels,
+                 lambdaBragg_0=self.lambdaBragg_0, s0=self.s0, s1=self.s1, s2=self.s2, k=self.k,
+                 tcs=self.tcs, cte=self.cte, T0=self.T0, devices=self.devices, alarm_min=self.alarm_min,
+                 alarm_max=self.alarm_max, alarm_rate=self.alarm_rate, hysteresis=self.hysteresis, mtime=mtime)
+
+    @classmethod
+    def load(cls, path):
+        # Retorna o SensorArray e o mtime da planilha de origem
+        with np.load(path) as f:
+            sensors = cls(f['names'], f['types'], f['channels'], f['lambdaBragg_0'],
+                          s0=f['s0'], s1=f['s1'], s2=f['s2'], k=f['k'], tcs=f['tcs'], cte=f['cte'], T0=f['T0'],
+                          devices=f['devices'] if 'devices' in f else None,
+                          **{name: f[name] for name in ('alarm_min', 'alarm_max', 'alarm_rate', 'hysteresis')
+                             if name in f})
+            return sensors, int(f['mtime'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def subset(self, idx):
+        return SensorArray(self.names[idx], self.types[idx], self.channels[idx], self.lambdaBragg_0[idx],
+                           s0=self.s0[idx], s1=self.s1[idx], s2=self.s2[idx], k=self.k[idx],
+                           tcs=self.tcs[idx], cte=self.cte[idx], T0=self.T0[idx], devices=self.devices[idx],
+                           alarm_min=self.alarm_min[idx], alarm_max=self.alarm_max[idx],
+                           alarm_rate=self.alarm_rate[idx], hysteresis=self.hysteresis[idx])
+
+    def device_list(self):
+        # Interrogadores em ordem crescente; a posição na lista é a do interrogador
+        # nas amostras e na lista de endereços
+        return sorted(set(self.devices.tolist()))
+
+    @property
+    def multi_device(self):
+        return len(self.device_list()) > 1
+
+    def channel_list(self, device=None):
+        # Canais na ordem em que aparecem na planilha
+        channels = self.channels if device is None else self.channels[self.devices == device]
+        return list(dict.fromkeys(channels.tolist()))
+
+    def acquisition_channels(self):
+        # Canais a ler: uma lista só, ou uma lista por interrogador
+        if not self.multi_device:
+            return self.channel_list()
+        return [self.channel_list(device) for device in self.device_list()]
+
+    def match(self, lambdas):
+        return self.match_batch([lambdas])[1][0]
+
+    def match_batch(self, peaks):
+        # Associa os picos de cada amostra (peaks[j], em qualquer ordem) aos sensores.
+        # Retorna a matriz (amostras x sensores) com o índice do pico em peaks[j]
+        # (-1 sem pico a menos de max_distance) e os comprimentos de onda (0 sem pico).
+        # Cada pico é atribuído a no máximo um sensor; em caso de disputa, a atribuição
+        # maximiza os sensores associados e depois minimiza a distância total.
+        n_samples = len(peaks)
+        n = len(self)
+        index = np.full((n_samples, n), -1, dtype=np.int64)
+        lambdaBragg = np.zeros((n_samples, n))
+        counts = np.array([len(p) for p in peaks], dtype=np.int64)
+        if n == 0 or counts.sum() == 0:
+            return index, lambdaBragg
+
+        w = self.max_distance
+        l0 = self.lambdaBragg_0[self.order]
+        values = np.concatenate([np.asarray(p, dtype=float).ravel() for p in peaks])
+        starts = np.cumsum(counts) - counts
+        row = np.repeat(np.arange(n_samples), counts)
+
+        # Todas as amostras numa única reta: cada amostra é deslocada de span,
+        # assim um único searchsorted resolve o lote inteiro
+        base = min(l0[0], values.min()) - 2 * w
+        span = max(l0[-1], values.max()) - base + 2 * w
+        order = np.argsort(values - base + row * span, kind='stable')
+        keys = (values - base + row * span)[order]
+        targets = l0[np.newaxis, :] - base + np.arange(n_samples)[:, np.newaxis] * span
+
+        lo = np.searchsorted(keys, targets - w, side='right')
+        hi = np.searchsorted(keys, targets + w, side='left')
+        pos = np.searchsorted(keys, targets)
+        has = hi > lo
+        left = np.clip(np.maximum(pos - 1, lo), 0, len(keys) - 1)
+        right = np.clip(np.minimum(pos, hi - 1), 0, len(keys) - 1)
+        claim = np.where(targets - keys[left] <= keys[right] - targets, left, right)
+        claim[~has] = -1
+
+        # Como sensores e picos estão ordenados, disputas aparecem entre sensores vizinhos
+        conflicts = np.argwhere((claim[:, 1:] == claim[:, :-1]) & (claim[:, 1:] >= 0))
+        resolved_until = -1
+        for j, i in conflicts:
+            if j * n + i <= resolved_until:
+                continue
+            a, b = i, i + 1
+            while a > 0 and has[j, a - 1] and hi[j, a - 1] > lo[j, a]:
+                a -= 1
+            while b < n - 1 and has[j, b + 1] and hi[j, b] > lo[j, b + 1]:
+                b += 1
+            claim[j, a:b + 1] = self._assign(targets[j, a:b + 1], keys, lo[j, a:b + 1], hi[j, a:b + 1])
+            resolved_until = j * n + b
+
+        found = claim >= 0
+        flat = order[np.where(found, claim, 0)]
+        sorted_index = np.where(found, flat - starts[:, np.newaxis], -1)
+        index[:, self.order] = sorted_index
+        lambdaBragg[:, self.order] = np.where(found, values[flat], 0)
+        return index, lambdaBragg
+
+    def match_samples(self, samples):
+        # samples[j]: picos por canal, como devolvidos por get_all_peaks. Com mais de um
+        # interrogador, samples[j][d] são os picos por canal (acquisition_channels()[d])
+        # do interrogador d, ou None se ele faltou na amostra; cada sensor então só
+        # disputa os picos do seu (interrogador, canal).
+        # Retorna os comprimentos de onda (amostras x sensores), 0 sem pico.
+        if not self.multi_device:
+            return self.match_batch([_join(sample) for sample in samples])[1]
+        if self.groups is None:
+            self.groups = []
+            for d, device in enumerate(self.device_list()):
+                for c, channel in enumerate(self.channel_list(device)):
+                    idx = np.flatnonzero((self.devices == device) & (self.channels == channel))
+                    self.groups.append((d, c, idx, self.subset(idx)))
+        lambdaBragg = np.zeros((len(samples), len(self)))
+        for d, c, idx, group in self.groups:
+            peaks = [sample[d][c] if sample[d] is not None else () for sample in samples]
+            lambdaBragg[:, idx] = group.match_batch(peaks)[1]
+        return lambdaBragg
+
+    @staticmethod
+    def _assign(targets, keys, lo, hi):
+        # Programação dinâmica sobre um grupo de sensores que disputam picos:
+        # em 1D basta considerar atribuições sem cruzamento. best[s][p] é o melhor
+        # (associados, -distância) com os s primeiros sensores e os p primeiros picos;
+        # cada linha só guarda a faixa de picos ao alcance do sensor, então o custo
+        # cresce com sensores x picos por janela e não com o tamanho do grupo.
+        k = len(targets)
+        p0 = lo[0]
+        L = lo - p0
+        H = hi - p0
+        rows = []
+
+        def get(s, p):
+            while s > 0:
+                if p > H[s - 1]:
+                    p = H[s - 1]
+                if p >= L[s - 1]:
+                    return rows[s - 1][p - L[s - 1]]
+                s -= 1
+            return (0, 0.0)
+
+        for s in range(1, k + 1):
+            row = []
+            for p in range(L[s - 1], H[s - 1] + 1):
+                cand = get(s - 1, p)
+                if p > L[s - 1]:
+                    cand = max(cand, row[-1])
+                    count, cost = get(s - 1, p - 1)
+                    cand = max(cand, (count + 1, cost - abs(keys[p0 + p - 1] - targets[s - 1])))
+                row.append(cand)
+            rows.append(row)
+
+        claim = np.full(k, -1, dtype=np.int64)
+        s, p = k, H[-1]
+        while s > 0 and p > 0:
+            p = min(p, H[s - 1])
+            if p < L[s - 1]:
+                s -= 1
+                continue
+            value = get(s, p)
+            if value == get(s - 1, p):
+                s -= 1
+            elif p > L[s - 1] and value == get(s, p - 1):
+                p -= 1
+            else:
+                claim[s - 1] = p0 + p - 1
+                s -= 1
+                p -= 1
+        return claim
+
+    def temperature(self, lambdaBragg):
+        # lambdaBragg: (..., n_sensores); NaN fora dos sensores de temperatura
+        lambdaBragg = np.asarray(lambdaBragg, dtype=float)
+        x = lambdaBragg - self.lambdaBragg_0
+        temperature = x ** 2 * self.s2 + x * self.s1 + self.s0
+        return np.where((lambdaBragg == 0) | ~self.is_temp, np.nan, temperature)
+
+    def mean_temperature(self, temperature):
+        temperature = temperature[..., self.is_temp]
+        working = np.count_nonzero(~np.isnan(temperature), axis=-1)
+        total = np.nansum(temperature, axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(working > 0, total / working, np.nan)
+
+    def strain(self, lambdaBragg, temperature=None):
+        # temperature: (...,) uma por amostra; NaN ou None usa T0 do sensor
+        lambdaBragg = np.asarray(lambdaBragg, dtype=float)
+        if temperature is None:
+            temperature = np.nan
+        temperature = np.asarray(temperature, dtype=float)[..., np.newaxis]
+        temperature = np.where(np.isnan(temperature), self.T0, temperature)
+        x = lambdaBragg - self.lambdaBragg_0
+        strain = x / (self.k * self.lambdaBragg_0) * 1e6 - (self.cte + self.tcs) * (temperature - self.T0)
+        return np.where((lambdaBragg == 0) | ~self.is_strain, np.nan, strain)
+
+    def columns(self):
+        # Colunas de uma linha de medição, na ordem gravada em disco
+        columns = []
+        for i in np.flatnonzero(self.is_temp):
+            columns += [f'Bragg (nm) @ {self.names[i]}', f'Temperatura (°C) @ {self.names[i]}']
+        columns.append('Temperatura (°C)')
+        for i in np.flatnonzero(self.is_strain):
+            columns += [f'Bragg (nm) @ {self.names[i]}', f'Strain (ue) @ {self.names[i]}']
+        return columns
+
+    def table(self, lambdaBragg, temperature, mean_temperature, strain):
+        # Monta as linhas (amostras x colunas) na ordem de columns()
+        temp_idx = np.flatnonzero(self.is_temp)
+        strain_idx = np.flatnonzero(self.is_strain)
+        n_samples = len(lambdaBragg)
+        n_temp = 2 * len(temp_idx)
+        rows = np.empty((n_samples, n_temp + 1 + 2 * len(strain_idx)))
+        rows[:, 0:n_temp:2] = lambdaBragg[:, temp_idx]
+        rows[:, 1:n_temp:2] = temperature[:, temp_idx]
+        rows[:, n_temp] = mean_temperature
+        rows[:, n_temp + 1::2] = lambdaBragg[:, strain_idx]
+        rows[:, n_temp + 2::2] = strain[:, strain_idx]
+        return rows
+
+    def convert(self, lambdaBragg):
+        temperature = self.temperature(lambdaBragg)
+        mean_temperature = self.mean_temperature(temperature)
+        strain = self.strain(lambdaBragg, mean_temperature)
+        return temperature, mean_temperature, strain
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+import logging
+import zipfile
+from sensor import SensorArray
+
+logger = logging.getLogger(__name__)
+
+required_columns = ['Sensor', 'Lambda Bragg (nm)', 'Tipo', 'Canal']
+strain_columns = ['k', 'tcs (um/m/°C)', 'cte (um/m/°C)', 'T0 (°C)']
+temperature_columns = ['s0 (°C)', 's1 (°C/nm)', 's2 (°C/nm²)']
+
+
+def compile_sheet(path, sheet):
+    # Lê e valida uma aba de sensores do Excel e a converte num SensorArray
+    import pandas as pd
+    df = pd.read_excel(path, sheet_name=sheet)
+    missing = [column for column in required_columns if column not in df]
+    if missing:
+        raise ValueError(f'Aba {sheet} de {path} sem as colunas {missing}')
+    unknown = sorted(set(df['Tipo']) - {'Temperatura', 'Deformação'})
+    if unknown:
+        logger.warning(f'Tipos de sensor ignorados em {sheet}: {unknown}')
+    if df['Lambda Bragg (nm)'].isna().any():
+        raise ValueError(f'Aba {sheet} de {path} com sensores sem Lambda Bragg')
+    for tipo, columns in (('Deformação', strain_columns), ('Temperatura', temperature_columns)):
+        rows = df[df['Tipo'] == tipo]
+        for column in columns:
+            if column not in df or rows[column].isna().any():
+                raise ValueError(f'Aba {sheet} de {path}: sensores de {tipo} sem {column}')
+    return SensorArray.from_dataframe(df)
+
+
+class SensorConfigCache:
+    # Configurações de sensores compiladas uma vez e guardadas por (arquivo, aba, mtime),
+    # em memória e em .npz no disco. Abas observadas são recarregadas em segundo plano
+    # quando a planilha muda, então get() quase nunca precisa abrir o Excel.
+    def __init__(self, cache_dir='.sensor_cache', poll_interval=2):
+        self.cache_dir = cache_dir
+        self.poll_interval = poll_interval
+        self.entries = {}
+        self.watched = set()
+        self.failed = {}
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def get(self, path, sheet):
+        key = (os.path.abspath(path), sheet)
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+        sensors = self._load(key, mtime)
+        with self.lock:
+            self.entries[key] = (mtime, sensors)
+        return sensors
+
+    def _cache_file(self, key):
+        digest = hashlib.sha1(f'{key[0]}\0{key[1]}'.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{digest}.npz')
+
+    def _load(self, key, mtime):
+        cache_file = self._cache_file(key)
+        try:
+            sensors, cached_mtime = SensorArray.load(cache_file)
+            if cached_mtime == mtime:
+                logger.debug(f'Sensores de {key[1]} lidos do cache {cache_file}')
+                return sensors
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # Cache ausente, antigo ou corrompido (gravação interrompida): recompila
+            pass
+        logger.info(f'Compilando sensores de {key[0]} [{key[1]}]')
+        sensors = compile_sheet(*key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            sensors.save(cache_file, mtime)
+        except OSError as e:
+            logger.warning(f'Não foi possível gravar o cache de sensores: {e}')
+        return sensors
+
+    def watch(self, path, sheets):
+        with self.lock:
+            self.watched.update((path, sheet) for sheet in sheets)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='sensor-config', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.lock:
+                watched = list(self.watched)
+            for path, sheet in watched:
+                try:
+                    self.get(path, sheet)
+                    self.failed.pop((path, sheet), None)
+                except Exception as e:
+                    # Só avisa de novo se o erro mudar, para não inundar o log a cada consulta
+                    if self.failed.get((path, sheet)) != str(e):
+                        self.failed[(path, sheet)] = str(e)
+                        logger.error(f'Erro ao carregar os sensores de {path} [{sheet}]: {e}')
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import time
+import logging
+import numpy as np
+from multiprocessing import shared_memory
+from acquisition import merge_channels
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PUBLISH = metrics.histogram('shm_publish_seconds', 'Escrita de um lote no anel em memória compartilhada')
+LOST = metrics.counter('shm_lost_total', 'Amostras sobrescritas no anel antes de serem lidas')
+
+FORMAT = '%(asctime)s @ %(name)s (%(levelname)s) >> %(message)s'
+MAGIC = 0x4252474752494E47  # 'BRGGRING'
+# Cabeçalho: 8 inteiros de 64 bits seguidos do JSON com os nomes dos sensores
+MAGIC_, CAPACITY, WIDTH, HEAD, RESERVED, CLOSED, META, PID = range(8)
+HEADER = 64
+
+
+def _open(name):
+    # No POSIX (Python < 3.13) quem só abre o segmento também o registraria no
+    # resource_tracker, que o apagaria quando esse processo saísse
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _layout(buf, capacity, width, meta_len):
+    start = HEADER + meta_len
+    start += -start % 64
+    time_ = np.ndarray((capacity,), dtype=np.float64, buffer=buf, offset=start)
+    data = np.ndarray((capacity, width), dtype=np.float64, buffer=buf, offset=start + 8 * capacity)
+    return time_, data
+
+
+class SampleRing:
+    # Anel de amostras em memória compartilhada: um único escritor (o daemon) e
+    # qualquer número de leitores em outros processos, sem trava. Cada linha é o
+    # horário (epoch) e data[linha] = [picos encontrados, Bragg de cada sensor].
+    # O escritor anuncia em RESERVED até onde vai escrever, grava as linhas e só
+    # então avança HEAD; o leitor descarta o que RESERVED mostrar que pode ter sido
+    # sobrescrito durante a cópia. Os campos são inteiros de 64 bits alinhados,
+    # gravados cada um de uma vez (ordem dos stores garantida em x86).
+    def __init__(self, name, sensor_names, capacity=65536):
+        self.meta = json.dumps({'sensors': [str(sensor) for sensor in sensor_names]}).encode()
+        self.width = len(sensor_names) + 1
+        self.capacity = capacity
+        size = HEADER + len(self.meta) + 64 + 8 * capacity * (self.width + 1)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._replace_stale(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+        self.header = np.ndarray((8,), dtype=np.int64, buffer=self.shm.buf)
+        self.header[:] = 0
+        self.shm.buf[HEADER:HEADER + len(self.meta)] = self.meta
+        self.time, self.data = _layout(self.shm.buf, capacity, self.width, len(self.meta))
+        self.header[CAPACITY] = capacity
+        self.header[WIDTH] = self.width
+        self.header[META] = len(self.meta)
+        self.header[PID] = os.getpid()
+        self.header[MAGIC_] = MAGIC
+        self.head = 0
+        logger.info(f'Anel {name}: {capacity} amostras de {len(sensor_names)} sensores ({size / 2 ** 20:.1f} MiB)')
+
+    @staticmethod
+    def _replace_stale(name):
+        # Só apaga um anel que sobrou de um escritor que caiu; o de um escritor
+        # vivo (outro daemon com o mesmo nome) não é tomado
+        old = _open(name)
+        header = np.ndarray((8,), dtype=np.int64, buffer=old.buf) if old.size >= HEADER else None
+        try:
+            if header is not None and header[MAGIC_] == MAGIC and not header[CLOSED] and _alive(int(header[PID])):
+                raise FileExistsError(f'Anel {name} em uso pelo processo {int(header[PID])}; '
+                                      f'use outro nome (--shm) ou encerre esse processo')
+            # Os leitores antigos veem CLOSED e reabrem
+            if header is not None:
+                header[CLOSED] = 1
+            logger.warning(f'Anel {name} abandonado por um escritor que caiu, recriando')
+        finally:
+            del header
+            old.close()
+        # Reaberto normalmente para o unlink casar com o registro no resource_tracker
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+
+    def write(self, timestamps, n_peaks, lambdaBragg):
+        t0 = metrics.clock()
+        n = len(timestamps)
+        if n == 0:
+            return
+        if n > self.capacity:
+            timestamps, n_peaks, lambdaBragg = timestamps[-self.capacity:], n_peaks[-self.capacity:], \
+                lambdaBragg[-self.capacity:]
+            self.head += n - self.capacity
+            n = self.capacity
+        slots = np.arange(self.head, self.head + n) % self.capacity
+        self.header[RESERVED] = self.head + n
+        self.time[slots] = timestamps
+        self.data[slots, 0] = n_peaks
+        self.data[slots, 1:] = lambdaBragg
+        self.head += n
+        self.header[HEAD] = self.head
+        PUBLISH.observe_since(t0)
+
+    def publish(self, batch, lambdaBragg, converted=None):
+        # Assinatura de AcquisitionCore.subscribe
+        self.write([sample.timestamp.timestamp() for sample in batch],
+                   [len(merge_channels(sample.data)) for sample in batch], lambdaBragg)
+
+    def close(self):
+        self.header[CLOSED] = 1
+        del self.header, self.time, self.data
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RingReader:
+    # Lê o anel de outro processo. read() devolve só as linhas novas desde a
+    # última chamada (cópia apenas delas); as que o escritor já sobrescreveu
+    # entram em lost. Se o anel não existe ou foi fechado, tenta abrir de novo
+    # na próxima leitura.
+    def __init__(self, name, from_start=False):
+        self.name = name
+        self.from_start = from_start
+        self.shm = None
+        self.sensors = None
+        self.cursor = 0
+        self.lost = 0
+
+    def attach(self):
+        try:
+            shm = _open(self.name)
+        except FileNotFoundError:
+            return False
+        header = np.ndarray((8,), dtype=np.int64, buffer=shm.buf)
+        if header[MAGIC_] != MAGIC or header[CLOSED]:
+            del header
+            shm.close()
+            return False
+        self.shm = shm
+        self.header = header
+        self.capacity = int(header[CAPACITY])
+        meta_len = int(header[META])
+        self.sensors = json.loads(bytes(shm.buf[HEADER:HEADER + meta_len]))['sensors']
+        self.time, self.data = _layout(shm.buf, self.capacity, int(header[WIDTH]), meta_len)
+        head = int(header[HEAD])
+        self.cursor = max(0, head - self.capacity) if self.from_start else head
+        logger.info(f'Anel {self.name} aberto: {len(self.sensors)} sensores, {head} amostras já escritas')
+        return True
+
+    def detach(self):
+        if self.shm is not None:
+            del self.header, self.time, self.data
+            self.shm.close()
+            self.shm = None
+
+    @property
+    def attached(self):
+        return self.shm is not None
+
+    def read(self):
+        # -> (horários, picos encontrados, Bragg por sensor), vazios se nada novo
+        empty = (np.empty(0), np.empty(0), np.empty((0, len(self.sensors or []))))
+        if self.shm is None and not self.attach():
+            return empty
+        if self.header[CLOSED]:
+            logger.warning(f'Anel {self.name} fechado pelo escritor')
+            self.detach()
+            return empty
+        head = int(self.header[HEAD])
+        start = max(self.cursor, head - self.capacity)
+        slots = np.arange(start, head) % self.capacity
+        timestamps = self.time[slots]
+        data = self.data[slots]
+        # Linhas abaixo de RESERVED - capacidade podem ter sido sobrescritas durante a cópia
+        safe = int(self.header[RESERVED]) - self.capacity
+        torn = min(max(0, safe - start), head - start)
+        lost = start - self.cursor + torn
+        if lost:
+            self.lost += lost
+            LOST.inc(lost)
+        self.cursor = head
+        return timestamps[torn:], data[torn:, 0], data[torn:, 1:]
+
+    def align(self, names):
+        # Índice, no anel, do sensor names[i] (-1 se o escritor não tem esse sensor)
+        position = {name: k for k, name in enumerate(self.sensors or [])}
+        return np.array([position.get(str(name), -1) for name in names], dtype=int)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Acompanha o anel de amostras publicado pelo daemon')
+    parser.add_argument('name', nargs='?', default='braggmeter', help='nome do segmento de memória compartilhada')
+    parser.add_argument('--interval', type=float, default=1, help='segundos entre leituras')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=FORMAT, datefmt='%d-%m-%Y %H:%M:%S')
+
+    reader = RingReader(args.name)
+    try:
+        while True:
+            time.sleep(args.interval)
+            timestamps, n_peaks, lambdaBragg = reader.read()
+            if len(timestamps):
+                print(f'{len(timestamps)} amostras, atraso {time.time() - timestamps[-1]:.3f} s, '
+                      f'perdidas {reader.lost}, último Bragg {np.round(lambdaBragg[-1], 4).tolist()}')
+    except KeyboardInterrupt:
+        reader.detach()
+
+
+if __name__ == '__main__':
+    main()
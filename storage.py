@@ -0,0 +1,208 @@
+import datetime
+import glob
+import io
+import os
+import queue
+import threading
+import time
+import logging
+import numpy as np
+import codec
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STORE = metrics.histogram('storage_write_seconds', 'Gravação de um lote no backend')
+
+
+class CsvBackend:
+    # Grava cada fluxo (uma aba de sensores) em arquivos CSV só de acréscimo,
+    # trocando de arquivo por tamanho ou idade. O custo de um flush depende só
+    # do número de linhas novas, nunca do tamanho do que já foi gravado.
+    extension = '.csv'
+
+    def __init__(self, directory='medições', max_bytes=64 * 2 ** 20, max_age=24 * 3600,
+                 time_column='Horário'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.time_column = time_column
+        self.files = {}     # stream -> (arquivo aberto, colunas, instante de abertura)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, stream):
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f'{stream}_{stamp}{self.extension}')
+        k = 0
+        while os.path.exists(path):
+            k += 1
+            path = os.path.join(self.directory, f'{stream}_{stamp}-{k}{self.extension}')
+        return path
+
+    def open(self, stream, columns):
+        self.close(stream)
+        path = self.path(stream)
+        f = open(path, 'w', encoding='utf-8', newline='')
+        f.write(','.join([self.time_column] + list(columns)) + '\n')
+        self.files[stream] = (f, list(columns), time.monotonic())
+        logger.info(f'Gravando {stream} em {path}')
+        return f
+
+    def needs_rotation(self, stream, columns):
+        if stream not in self.files:
+            return True
+        f, current_columns, opened = self.files[stream]
+        return current_columns != list(columns) or f.tell() >= self.max_bytes or \
+            (self.max_age is not None and time.monotonic() - opened >= self.max_age)
+
+    def write(self, stream, columns, timestamps, data):
+        if self.needs_rotation(stream, columns):
+            f = self.open(stream, columns)
+        else:
+            f = self.files[stream][0]
+        body = io.StringIO()
+        np.savetxt(body, np.atleast_2d(data), delimiter=',', fmt='%.10g')
+        stamps = [datetime.datetime.fromtimestamp(t).isoformat(sep=' ') for t in timestamps]
+        f.writelines(f'{stamp},{row}\n' for stamp, row in zip(stamps, body.getvalue().splitlines()))
+        f.flush()
+
+    def close(self, stream=None):
+        streams = list(self.files) if stream is None else [stream]
+        for s in streams:
+            if s in self.files:
+                self.files.pop(s)[0].close()
+
+    def list_files(self, stream=None):
+        pattern = f'{stream}_*{self.extension}' if stream is not None else f'*{self.extension}'
+        return sorted(glob.glob(os.path.join(self.directory, pattern)))
+
+
+class BinaryBackend(CsvBackend):
+    # Mesmos arquivos e rotação do CsvBackend, no formato compacto do codec:
+    # cada write() vira um bloco comprimido, independente dos anteriores
+    extension = codec.EXTENSION
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resolutions = {}
+
+    def open(self, stream, columns):
+        self.close(stream)
+        path = self.path(stream)
+        f = open(path, 'wb')
+        self.resolutions[stream] = [codec.resolution(column) for column in columns]
+        f.write(codec.header(columns, self.resolutions[stream], self.time_column))
+        self.files[stream] = (f, list(columns), time.monotonic())
+        logger.info(f'Gravando {stream} em {path}')
+        return f
+
+    def write(self, stream, columns, timestamps, data):
+        if len(timestamps) == 0:
+            return
+        if self.needs_rotation(stream, columns):
+            f = self.open(stream, columns)
+        else:
+            f = self.files[stream][0]
+        f.write(codec.encode_block(timestamps, data, self.resolutions[stream]))
+        f.flush()
+
+
+BACKENDS = {'csv': CsvBackend, 'brg': BinaryBackend}
+
+
+class StorageWriter:
+    # Uma única thread de gravação, de vida longa, alimentada por uma fila:
+    # flushes nunca disputam o mesmo arquivo e não bloqueiam quem produz os dados
+    def __init__(self, backend, maxsize=256):
+        self.backend = backend
+        self.queue = queue.Queue(maxsize=maxsize)
+        metrics.gauge('storage_queue_depth', 'Lotes esperando gravação', fn=self.queue.qsize)
+        self.thread = threading.Thread(target=self._run, name='storage', daemon=True)
+        self.thread.start()
+
+    def submit(self, stream, columns, timestamps, data):
+        # Copia os dados: quem chama pode estar passando uma visão do SampleBuffer
+        self.queue.put((stream, list(columns), np.array(timestamps, dtype=float), np.array(data, dtype=float)))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            stream, columns, timestamps, data = item
+            try:
+                with STORE.time():
+                    self.backend.write(stream, columns, timestamps, data)
+            except Exception as e:
+                logger.error(f'Erro ao salvar: {e}')
+                try:
+                    # Tenta de novo num arquivo novo
+                    self.backend.close(stream)
+                    self.backend.write(stream, columns, timestamps, data)
+                except Exception as e:
+                    logger.error(f'Dados perdidos ao salvar {stream}: {e}')
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.backend.close()
+
+
+def read_measurements(path, time_column='Horário'):
+    # Um arquivo gravado (CSV ou binário) como DataFrame, com os horários já convertidos
+    import pandas as pd
+    if path.endswith(codec.EXTENSION):
+        return codec.read_dataframe(path)
+    return pd.read_csv(path, parse_dates=[time_column])
+
+
+EXCEL_ROWS = 1048576    # linhas de uma aba do Excel, contando o cabeçalho
+
+
+def _sheet_name(stream, part):
+    # Abas têm no máximo 31 caracteres; as continuações ganham _2, _3...
+    suffix = f'_{part}' if part > 1 else ''
+    return stream[:31 - len(suffix)] + suffix
+
+
+def export_excel(paths, xlsx_path, time_column='Horário', start=None, end=None, max_rows=EXCEL_ROWS - 1):
+    # Exportação sob demanda: os arquivos de cada fluxo, em ordem, numa aba do
+    # Excel, só com as linhas entre start e end (datetime; None não limita).
+    # Passando do limite de linhas, o fluxo continua em <fluxo>_2, <fluxo>_3...
+    # Lê um arquivo por vez, então no máximo uma aba fica em memória.
+    import pandas as pd
+    from history import file_order, stream_of
+    streams = {}
+    for path in sorted(paths, key=file_order):
+        streams.setdefault(stream_of(path), []).append(path)
+    total = 0
+    with pd.ExcelWriter(xlsx_path) as writer:
+        for stream, stream_paths in streams.items():
+            pending, count, part = [], 0, 1
+            for path in stream_paths:
+                df = read_measurements(path, time_column)
+                if start is not None:
+                    df = df[df[time_column] >= start]
+                if end is not None:
+                    df = df[df[time_column] <= end]
+                while len(df):
+                    pending.append(df.iloc[:max_rows - count])
+                    count += len(pending[-1])
+                    df = df.iloc[len(pending[-1]):]
+                    if count == max_rows:
+                        pd.concat(pending).to_excel(writer, sheet_name=_sheet_name(stream, part), index=False)
+                        total += count
+                        pending, count, part = [], 0, part + 1
+            # A última aba (ou uma só com o cabeçalho, se nada caiu no intervalo)
+            if pending or part == 1:
+                df = pd.concat(pending) if pending else read_measurements(stream_paths[0], time_column).iloc[:0]
+                df.to_excel(writer, sheet_name=_sheet_name(stream, part), index=False)
+                total += count
+    logger.info(f'{total} linhas de {len(paths)} arquivos exportadas para {xlsx_path}')
+    return total